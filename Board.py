@@ -1,11 +1,15 @@
 import abc
-import random
+import bisect
 import pylab
 import math
-import pygame as pg
+import itertools
+import threading
+import collections
+import numpy as np
 import networkx as nx
 import matplotlib.pyplot as plt
-from Game import Player, Strategy
+from Game import Player, Strategy, make_rng
+from GridRenderer import GridRenderer
 
 """
 An abstract base class for the board, the topological environmental in
@@ -16,6 +20,23 @@ which the players interact
 class Board(abc.ABC):
     @abc.abstractmethod
     def assign_player_to_cell(self, player, cell):
+        """ must keep the index of free cells up to date """
+        pass
+
+    def update_cell_strategy(self, cell, strategy):
+        """records that the player in a cell changed its strategy, for
+        boards keeping the strategies of their cells
+        """
+        pass
+
+    @abc.abstractmethod
+    def cell_index(self, cell):
+        """ gets the index (from 0 to the number of cells) of a cell """
+        pass
+
+    @abc.abstractmethod
+    def index_cell(self, index):
+        """ gets the cell with an index """
         pass
 
     @abc.abstractmethod
@@ -27,11 +48,24 @@ class Board(abc.ABC):
         """ determines whether a cell is occupied by a player """
         pass
 
+    def get_distance_rank(self, cell1, cell2):
+        """gets a number which orders pairs of cells by their distance like
+        get_distance_between does, cheaper to compute on some boards
+        """
+        return self.get_distance_between(cell1, cell2)
+
     @abc.abstractmethod
     def get_distance_between(self, cell1, cell2):
         """ calculates the distance between two cells """
         pass
 
+    @abc.abstractmethod
+    def get_cells_in_play_neighborhood(self, cell):
+        """gets the cells whose players a player in a cell would be able to
+        play with
+        """
+        pass
+
     @abc.abstractmethod
     def get_players_in_play_neighborhood(self, cell):
         """gets the players which a player in a cell would be able to play
@@ -39,6 +73,15 @@ class Board(abc.ABC):
         """
         pass
 
+    def get_strategy_counts_in_play_neighborhood(self, cell):
+        """counts the players using each strategy (by value) among those a
+        player in a cell would be able to play with
+        """
+        counts = [0] * len(Strategy)
+        for player in self.get_players_in_play_neighborhood(cell):
+            counts[player.strategy.value] += 1
+        return counts
+
     @abc.abstractmethod
     def get_empty_cells_in_migration_neighboorhood(self, cell, M):
         """gets the empty cells which a player in a cell would be able to
@@ -56,16 +99,97 @@ class Board(abc.ABC):
         """ draws the board on screen """
         pass
 
+    def init_free_cells(self, num_cells):
+        """sets up the index of free cells, in which the indices of the empty
+        cells are kept in a list and the position of every cell in that list
+        (-1 if occupied) in another list, so that cells can be added, removed
+        and sampled in constant time
+        """
+        self.free_cells = list(range(num_cells))
+        self.free_cell_positions = list(range(num_cells))
+
+    def update_free_cells(self, cell, occupied):
+        """ records whether a cell is occupied in the index of free cells """
+        self.update_free_index(self.cell_index(cell), occupied)
+
+    def update_free_index(self, index, occupied):
+        """ like update_free_cells, with the cell given by its index """
+        position = self.free_cell_positions[index]
+        if occupied and position >= 0:
+            # swap the cell with the last free cell and remove it
+            last_index = self.free_cells.pop()
+            if last_index != index:
+                self.free_cells[position] = last_index
+                self.free_cell_positions[last_index] = position
+            self.free_cell_positions[index] = -1
+        elif not occupied and position < 0:
+            self.free_cell_positions[index] = len(self.free_cells)
+            self.free_cells.append(index)
+
+    def set_free_cells(self, free_cells):
+        """replaces the index of free cells by the given empty cells (as
+        indices) in that order, which decides the cells random_free_cell
+        draws
+        """
+        self.free_cells = list(free_cells)
+        self.free_cell_positions = [-1] * len(self.free_cell_positions)
+        for position, index in enumerate(self.free_cells):
+            self.free_cell_positions[index] = position
+
+    def num_free_cells(self):
+        """ gets the number of empty cells """
+        return len(self.free_cells)
+
+    def random_free_cell(self, rng=None):
+        """gets a uniformly random empty cell, or None if there is none,
+        drawn from a random number generator (by default that of the board)
+        """
+        if not self.free_cells:
+            return None
+        if rng is None:
+            rng = self.rng
+        index = self.free_cells[int(rng.integers(len(self.free_cells)))]
+        return self.index_cell(index)
+
 
 class RectangularGrid(Board):
-    def __init__(self, height, width):
+    def __init__(self, height, width, seed=None, renderer=None):
+        """
+        - height, width: the dimensions of the grid
+        - seed: a seed or numpy random number generator for the random
+          choices of the board (see make_rng)
+        - renderer: the GridRenderer drawing the board, by default one
+          showing it in a window
+        """
         # grid setup
         self.height = height
         self.width = width
+        self.rng = make_rng(seed)
+        self.renderer = renderer
         self.grid = [[None for j in range(width)] for i in range(height)]
+        self.init_free_cells(height * width)
+        # the strategy value of the player in each cell (-1 if empty), kept
+        # up to date so that the strategy grid can be copied at once
+        self.strategies = np.full((height, width), -1, dtype=np.int8)
+
+        # the rows and columns next to each row and column, across the
+        # periodic boundaries
+        self.play_rows = get_wrapped_ranges(height, 1)
+        self.play_columns = get_wrapped_ranges(width, 1)
 
     def assign_player_to_cell(self, player, cell):
         self.grid[cell[0]][cell[1]] = player
+        self.update_free_cells(cell, player != None)
+        self.strategies[cell] = -1 if player == None else player.strategy.value
+
+    def update_cell_strategy(self, cell, strategy):
+        self.strategies[cell] = strategy.value
+
+    def cell_index(self, cell):
+        return cell[0] * self.width + cell[1]
+
+    def index_cell(self, index):
+        return divmod(index, self.width)
 
     def get_player_from_cell(self, cell):
         return self.grid[cell[0]][cell[1]]
@@ -78,23 +202,39 @@ class RectangularGrid(Board):
         y2, x2 = cell2
         return math.sqrt((x1 - x2) ** 2 + (y1 - y2) ** 2)
 
-    def get_players_in_play_neighborhood(self, cell):
-        """gets the players in the Moore neighborhood of a cell"""
+    def get_distance_rank(self, cell1, cell2):
+        """gets the squared distance between two cells, which orders them
+        like get_distance_between without taking square roots
+        """
+        y1, x1 = cell1
+        y2, x2 = cell2
+        return (x1 - x2) ** 2 + (y1 - y2) ** 2
+
+    def get_cells_in_play_neighborhood(self, cell):
+        """gets the cells in the Moore neighborhood of a cell"""
         i, j = cell
-        players = []
 
         # Moore neighborhood accounting for periodic boundary conditions
-        cell_above = ((i - 1) % self.height, j)
-        cell_below = ((i + 1) % self.height, j)
-        cell_left = (i, (j - 1) % self.width)
-        cell_right = (i, (j + 1) % self.width)
-        moore_neighborhood = [cell_above, cell_below, cell_left, cell_right]
+        rows = self.play_rows[i]
+        columns = self.play_columns[j]
+        return [(rows[0], j), (rows[2], j), (i, columns[0]), (i, columns[2])]
 
-        for cell in moore_neighborhood:
-            if self.occupied(cell):
-                players.append(self.get_player_from_cell(cell))
+    def get_players_in_play_neighborhood(self, cell):
+        """gets the players in the Moore neighborhood of a cell"""
+        i, j = cell
+        rows = self.play_rows[i]
+        columns = self.play_columns[j]
+        row = self.grid[i]
+        candidates = (self.grid[rows[0]][j], self.grid[rows[2]][j],
+                      row[columns[0]], row[columns[2]])
 
-        return players
+        return [player for player in candidates if player != None]
+
+    def get_strategy_grid(self):
+        """gets the strategy values of the players in all cells as an array,
+        with -1 in empty cells
+        """
+        return self.strategies.copy()
 
     def get_empty_cells_in_migration_neighboorhood(self, cell, M):
         """gets the empty cells in the Neumann neighborhood of range M of
@@ -103,23 +243,23 @@ class RectangularGrid(Board):
         i, j = cell
         neighboring_empty_cells = []
 
-        for a in range(i - M, i + M + 1):
-            for b in range(j - M, j + M + 1):
-                # cell coordinates accounting for periodic boundary conditions
-                m = a % self.height
-                n = b % self.width
-
-                # ignore the cell itself
-                if m == i and n == j:
-                    continue
-
-                if self.grid[m][n] == None:
+        # cell coordinates accounting for periodic boundary conditions
+        columns = get_wrapped_ranges(self.width, M)[j]
+        for m in get_wrapped_ranges(self.height, M)[i]:
+            row = self.grid[m]
+            for n in columns:
+                if row[n] == None:
+                    # ignore the cell itself
+                    if m == i and n == j:
+                        continue
                     neighboring_empty_cells.append((m, n))
 
         return neighboring_empty_cells
 
     def quit_animation(self):
-        pg.quit()
+        if self.renderer is not None:
+            self.renderer.close()
+            self.renderer = None
 
     def random_cell_sequence(self):
 
@@ -128,68 +268,140 @@ class RectangularGrid(Board):
         for i in range(self.height):
             for j in range(self.width):
                 random_cell_sequence.append((i, j))
-        random.shuffle(random_cell_sequence)
+        self.rng.shuffle(random_cell_sequence)
 
         return random_cell_sequence
 
-    def draw(self):
+    def draw(self, strategies=None):
+        """draws the board with its renderer (by default in a window), or
+        the given strategy grid instead of the players on the board
+        """
+        if self.renderer is None:
+            self.renderer = GridRenderer()
+        # the grid of a frame which is skipped is not needed
+        if strategies is None and not self.renderer.skips_next():
+            strategies = self.strategies
+        self.renderer.render(strategies)
 
-        # visualization setup on first pass
-        pg.init()
-        try:
-            self.screen
-        except AttributeError:
-            background_color = (0, 0, 0)
-            cell_height = 16
-            cell_width = 16
-            screen_dimensions = (cell_width * self.width,
-                                 cell_height * self.height)
-            pg.init()
-            self.screen = pg.display.set_mode(screen_dimensions)
-            pg.display.set_caption("Strategy Evolution Simulation")
-            self.screen.fill(background_color)
-
-        # proper closing of the window....
-        for event in pg.event.get():
-            if event.type == pg.QUIT:
-                running = False
-                pg.quit()
-
-        # draw board cell by cell
-        blue = (0, 0, 255)
-        red = (255, 0, 0)
-        white = (255, 255, 255)
 
-        for i in range(self.height):
-            for j in range(self.width):
+# the coordinates from x - M to x + M wrapped around the periodic boundaries,
+# for every coordinate x along an axis, by (axis length, M)
+wrapped_ranges = {}
 
-                # define top-left pixel of cell
-                tup = (j * 16, i * 16, 16, 16)
 
-                # determine cell colouring
-                player = self.grid[i][j]
-                if player:
-                    if player.strategy == Strategy.cooperate:
-                        pg.draw.rect(self.screen, blue, tup, 0)
-                    elif player.strategy == Strategy.defect:
-                        pg.draw.rect(self.screen, red, tup, 0)
-                    else:
-                        pg.draw.rect(self.screen, white, tup, 0)
-                else:
-                    pg.draw.rect(self.screen, white, tup, 0)
+def get_wrapped_ranges(size, M):
+    """gets the coordinates from x - M to x + M around every coordinate x
+    along an axis of the given size, with the periodic boundaries applied,
+    computed once for all boards
+    """
+    key = (size, M)
+    if key not in wrapped_ranges:
+        wrapped_ranges[key] = [[a % size for a in range(x - M, x + M + 1)]
+                               for x in range(size)]
+    return wrapped_ranges[key]
 
-        pg.display.update()
+
+# layouts of network boards:
+# - spring: a force directed layout of the graph (slow for large graphs)
+# - circular: the nodes in order on a circle, which shows the ring lattice
+#   the Watts-Strogatz graph is built from
+# - lattice: a spring layout of the ring lattice, computed once and reused by
+#   all boards with the same number of nodes and neighbors
+LAYOUTS = ("spring", "circular", "lattice")
+lattice_layouts = {}
 
 
 class Network(Board):
-    def __init__(self, N, k, p):
+    def __init__(self, N, k, p, csr=False, max_cached_cells=10 ** 7,
+                 layout="spring", seed=None):
+        """
+        - N, k, p: the parameters of the Watts-Strogatz graph
+        - csr: whether to freeze the graph into compressed sparse row arrays
+          (see freeze), which speeds up neighbor queries on large graphs
+        - max_cached_cells: the total number of cells kept in the cache of
+          migration neighborhoods, which bounds its memory (see
+          get_migration_neighborhood)
+        - layout: how the nodes are placed when drawing the board (see
+          LAYOUTS). The layout is only computed on the first draw
+        - seed: a seed or numpy random number generator for the generation
+          of the graph and the random choices of the board (see make_rng)
+        """
+        if layout not in LAYOUTS:
+            print("Error! Unknown network layout", layout)
+            quit()
+
         self.N = N
-        self.graph = nx.watts_strogatz_graph(N, k, p)
-        self.pos = nx.spring_layout(self.graph)
+        self.k = k
+        self.rng = make_rng(seed)
+        self.graph = nx.watts_strogatz_graph(
+            N, k, p, seed=int(self.rng.integers(2 ** 31)))
+        self.layout = layout
+        self.pos = None
         self.players = [None for i in range(N)]
+        self.empty = np.ones(N, dtype=bool)
+        # the strategy value of the player in each node (-1 if empty)
+        self.strategies = np.full(N, -1, dtype=np.int8)
+        self.init_free_cells(N)
+        self.csr = csr
+        if csr:
+            self.freeze()
+
+        # least recently used migration neighborhoods by cell
+        self.neighborhoods = collections.OrderedDict()
+        self.num_cached_cells = 0
+        self.max_cached_cells = max_cached_cells
+        # scratch array marking the cells reached by a breadth first search
+        self.visited = np.zeros(N, dtype=bool)
+        # the cache is shared by the threads of a synchronous update
+        self.neighborhoods_lock = threading.Lock()
+
+    def freeze(self):
+        """stores the adjacency of the graph in compressed sparse row arrays:
+        the neighbors of a cell are indices[indptr[cell]:indptr[cell + 1]],
+        in the same order as in the graph. The networkx graph is released to
+        save memory and only rebuilt for drawing (see get_graph)
+        """
+        degrees = np.fromiter((len(self.graph.adj[cell])
+                               for cell in range(self.N)),
+                              dtype=np.int64, count=self.N)
+        self.indptr = np.zeros(self.N + 1, dtype=np.int64)
+        np.cumsum(degrees, out=self.indptr[1:])
+        self.indices = np.fromiter(
+            itertools.chain.from_iterable(self.graph.adj[cell]
+                                          for cell in range(self.N)),
+            dtype=np.int32, count=int(self.indptr[-1]))
+        # python ints and a memoryview are faster to slice and iterate than
+        # numpy arrays for the small neighborhoods of single cells
+        self.row_starts = self.indptr.tolist()
+        self.neighbor_view = memoryview(self.indices)
+        self.graph = None
+
+    def get_graph(self):
+        """ gets the networkx graph, rebuilding it if the board is frozen """
+        if self.graph == None:
+            degrees = np.diff(self.indptr)
+            graph = nx.Graph()
+            graph.add_nodes_from(range(self.N))
+            graph.add_edges_from(zip(
+                np.repeat(np.arange(self.N), degrees).tolist(),
+                self.indices.tolist()))
+            return graph
+        return self.graph
 
     def assign_player_to_cell(self, player, cell):
         self.players[cell] = player
+        self.empty[cell] = player == None
+        self.update_free_cells(cell, player != None)
+        self.strategies[cell] = -1 if player == None else player.strategy.value
+
+    def update_cell_strategy(self, cell, strategy):
+        self.strategies[cell] = strategy.value
+
+    def cell_index(self, cell):
+        return cell
+
+    def index_cell(self, index):
+        return index
 
     def get_player_from_cell(self, cell):
         return self.players[cell]
@@ -198,10 +410,38 @@ class Network(Board):
         return self.players[cell] != None
 
     def get_distance_between(self, cell1, cell2):
-        quit("Migration not implemented on network board")
+        """gets the number of hops between two cells, looking them up in a
+        cached migration neighborhood of either cell if possible
+        """
+        if cell1 == cell2:
+            return 0
+        for cell, other_cell in ((cell2, cell1), (cell1, cell2)):
+            with self.neighborhoods_lock:
+                neighborhood = self.neighborhoods.get(cell)
+            if neighborhood != None:
+                cells, layer_starts = neighborhood
+                position = np.flatnonzero(cells == other_cell)
+                if len(position) > 0:
+                    return bisect.bisect_right(layer_starts,
+                                               position[0]) - 1
+        if not self.csr:
+            return nx.shortest_path_length(self.graph, cell1, cell2)
+        # the graph of a frozen board is not rebuilt
+        with self.neighborhoods_lock:
+            return self.breadth_first_distance(cell1, cell2)
+
+    def get_cells_in_play_neighborhood(self, cell):
+        if self.csr:
+            return list(self.neighbor_view[
+                self.row_starts[cell]:self.row_starts[cell + 1]])
+        return list(self.graph.neighbors(cell))
 
     def get_players_in_play_neighborhood(self, cell):
-        neighboring_cells = self.graph.neighbors(cell)
+        if self.csr:
+            neighboring_cells = self.neighbor_view[
+                self.row_starts[cell]:self.row_starts[cell + 1]]
+        else:
+            neighboring_cells = self.graph.neighbors(cell)
 
         neighboring_players = []
         for neighboring_cell in neighboring_cells:
@@ -211,24 +451,128 @@ class Network(Board):
         return neighboring_players
 
     def get_empty_cells_in_migration_neighboorhood(self, cell, radius):
-        quit("Migration not implemented on network board")
-        # ego_graph = nx.generators.ego.ego_graph(self.graph, \
-        #                                       cell, radius, center=False)
-        # neighboring_cells = list(ego_graph.nodes)
-        #
-        # neighboring_empty_cells = []
-        # for cell in neighboring_cells:
-        #     if self.players[cell] == None:
-        #         neighboring_empty_cells.append(cell)
-        #
-        # return neighboring_empty_cells
+        """gets the empty cells at most radius hops away from the cell,
+        ordered by distance
+        """
+        cells, layer_starts = self.get_migration_neighborhood(cell, radius)
+        cells = cells[1:]
+        return cells[self.empty[cells]].tolist()
+
+    def get_migration_neighborhood(self, cell, radius):
+        """gets the cells at most radius hops away from a cell as an array
+        ordered by distance (and by cell within the same distance), starting
+        with the cell itself, together with the positions in that array at
+        which the cells at each distance start. Neighborhoods are cached, and
+        the least recently used ones are dropped when the cache holds more
+        than max_cached_cells cells
+        """
+        with self.neighborhoods_lock:
+            if cell in self.neighborhoods:
+                cells, layer_starts = self.neighborhoods[cell]
+                if len(layer_starts) > radius + 1:
+                    self.neighborhoods.move_to_end(cell)
+                    return (cells[:layer_starts[radius + 1]],
+                            layer_starts[:radius + 2])
+                self.num_cached_cells -= len(cells)
+                del self.neighborhoods[cell]
+
+            cells, layer_starts = self.breadth_first_layers(cell, radius)
+            self.neighborhoods[cell] = (cells, layer_starts)
+            self.num_cached_cells += len(cells)
+            while (self.num_cached_cells > self.max_cached_cells and
+                   len(self.neighborhoods) > 1):
+                dropped_cells, dropped_starts = self.neighborhoods.popitem(
+                    last=False)[1]
+                self.num_cached_cells -= len(dropped_cells)
+
+            return cells, layer_starts
+
+    def breadth_first_layers(self, cell, radius):
+        """finds the cells at most radius hops away from a cell by a breadth
+        first search (see get_migration_neighborhood)
+        """
+        layers = [np.array([cell])]
+        self.visited[cell] = True
+        for distance in range(radius):
+            reached = self.frontier_neighbors(layers[-1])
+            layer = np.unique(reached[~self.visited[reached]])
+            if len(layer) == 0:
+                break
+            self.visited[layer] = True
+            layers.append(layer)
+
+        cells = np.concatenate(layers).astype(np.int32)
+        self.visited[cells] = False
+        layer_starts = [0]
+        for layer in layers:
+            layer_starts.append(layer_starts[-1] + len(layer))
+        # layers beyond the last one reached are empty
+        layer_starts += [layer_starts[-1]] * (radius + 1 - len(layers))
+        return cells, layer_starts
+
+    def breadth_first_distance(self, cell1, cell2):
+        """counts the hops between two cells by a breadth first search from
+        the first one, infinite if they are not connected
+        """
+        frontier = np.array([cell1])
+        self.visited[cell1] = True
+        reached_cells = [frontier]
+        distance = 0
+        while len(frontier) > 0 and not self.visited[cell2]:
+            reached = self.frontier_neighbors(frontier)
+            frontier = np.unique(reached[~self.visited[reached]])
+            self.visited[frontier] = True
+            reached_cells.append(frontier)
+            distance += 1
+
+        found = bool(self.visited[cell2])
+        for cells in reached_cells:
+            self.visited[cells] = False
+        return distance if found else math.inf
+
+    def frontier_neighbors(self, frontier):
+        """ gets the neighbors of all cells of an array, with repetitions """
+        if self.csr:
+            # gather the rows of all cells of the frontier at once
+            starts = self.indptr[frontier]
+            degrees = self.indptr[frontier + 1] - starts
+            offsets = np.repeat(starts - np.cumsum(degrees) + degrees,
+                                degrees)
+            return self.indices[offsets + np.arange(len(offsets))]
+        return np.fromiter(
+            itertools.chain.from_iterable(
+                self.graph.adj[int(c)] for c in frontier),
+            dtype=np.int64)
 
     def random_cell_sequence(self):
         random_cell_sequence = [i for i in range(self.N)]
-        random.shuffle(random_cell_sequence)
+        self.rng.shuffle(random_cell_sequence)
         return random_cell_sequence
 
-    def draw(self):
+    def compute_layout(self, graph):
+        """ computes the positions of the nodes for drawing """
+        if self.layout == "spring":
+            return nx.spring_layout(graph)
+        elif self.layout == "circular":
+            return nx.circular_layout(graph)
+        elif self.layout == "lattice":
+            # the spring layout of the ring lattice before rewiring, shared
+            # by all boards with the same N and k
+            if (self.N, self.k) not in lattice_layouts:
+                lattice_layouts[(self.N, self.k)] = nx.spring_layout(
+                    nx.watts_strogatz_graph(self.N, self.k, 0), seed=0)
+            return lattice_layouts[(self.N, self.k)]
+
+    def get_strategy_grid(self):
+        """gets the strategy values of the players in all nodes as an array,
+        with -1 in empty nodes
+        """
+        return self.strategies.copy()
+
+    def draw(self, strategies=None):
+        """draws the network, or the given strategy values of the nodes (see
+        get_strategy_grid) instead of the players on the board
+        """
         # board setup on first pass
         try:
             self.figure
@@ -237,17 +581,22 @@ class Network(Board):
             self.figure = plt.figure("Board")
             self.figure.show()
 
+        graph = self.get_graph()
+        if self.pos == None:
+            self.pos = self.compute_layout(graph)
+        if strategies is None:
+            strategies = self.get_strategy_grid()
+
         color_map = []
-        for cell in self.graph:
-            if self.players[cell] == None:
-                color_map.append("black")
+        for cell in graph:
+            if strategies[cell] == Strategy.cooperate.value:
+                color_map.append("blue")
+            elif strategies[cell] == Strategy.defect.value:
+                color_map.append("red")
             else:
-                if self.players[cell].strategy == Strategy.cooperate:
-                    color_map.append("blue")
-                elif self.players[cell].strategy == Strategy.defect:
-                    color_map.append("red")
+                color_map.append("black")
 
         plt.figure(self.figure.number)
-        nx.draw(self.graph, node_color=color_map,
+        nx.draw(graph, node_color=color_map,
                 with_labels=True, pos=self.pos)
         self.figure.canvas.flush_events()
@@ -0,0 +1,185 @@
+import os
+import json
+import numpy as np
+from World import World
+from Board import RectangularGrid
+from Population import Population
+from Game import (
+    PrisonersDilemma,
+    AsymmetricPrisonersDilemma,
+    Player,
+    PrisonersDilemmaPlayer,
+    AsymmetricPrisonersDilemmaPlayer,
+    Strategy,
+    NEEDS,
+    pack_needs,
+    make_rng,
+)
+
+"""
+Checkpoints of simulations of a World on a RectangularGrid, from which they
+can be continued exactly as if they had never stopped.
+
+A checkpoint is a NumPy .npz file (loaded without pickle) holding arrays of
+the strategies, cells, payoffs and needs of the players in the order in
+which the world keeps them, the free cells of the board in the order of its
+index, and the time series of the statistics, together with a JSON
+description of the game, the parameters of the world, the states of the
+random number generators, the cached payoffs and the remaining statistics.
+"""
+
+# the games which can be rebuilt from their parameters
+GAMES = {"PrisonersDilemma": PrisonersDilemma,
+         "AsymmetricPrisonersDilemma": AsymmetricPrisonersDilemma}
+
+# the parameters of a World kept in checkpoints
+WORLD_PARAMETERS = ["r", "q", "noise1", "noise2", "imitation", "migration",
+                    "M", "debug_payoff_cache", "update", "num_threads"]
+
+
+def player_kind(world):
+    """returns how the players of a world are rebuilt: "population",
+    "asymmetric" or "player"
+    """
+    if world.population is not None:
+        return "population"
+    kinds = set()
+    for player in world.players:
+        if isinstance(player, AsymmetricPrisonersDilemmaPlayer):
+            kinds.add("asymmetric")
+        elif type(player) in (Player, PrisonersDilemmaPlayer):
+            kinds.add("player")
+        else:
+            kinds.add(type(player).__name__)
+    if len(kinds) > 1 or not kinds <= {"asymmetric", "player"}:
+        print("Error! Checkpoints do not support players of the types",
+              sorted(kinds))
+        quit()
+    return kinds.pop() if kinds else "player"
+
+
+def save_checkpoint(filename, world, stats=None, iteration=0):
+    """writes a checkpoint of a world and its statistics, taken before the
+    given iteration. The file is replaced at once, so that a crash while
+    writing leaves the previous checkpoint
+    """
+    if not isinstance(world, World) or \
+            not isinstance(world.board, RectangularGrid):
+        print("Error! Checkpoints are only supported for World on a",
+              "RectangularGrid")
+        quit()
+
+    board = world.board
+    kind = player_kind(world)
+    arrays = {
+        "strategies": np.array([player.strategy.value
+                                for player in world.players], dtype=np.int8),
+        "cells": np.array([board.cell_index(player.cell)
+                           for player in world.players], dtype=np.int64),
+        "payoffs": np.array([player.payoff for player in world.players],
+                            dtype=np.float64),
+        "free_cells": np.array(board.free_cells, dtype=np.int64),
+    }
+    if kind != "player":
+        arrays["needs"] = pack_needs(
+            *[np.array([getattr(player, need) for player in world.players],
+                       dtype=np.uint8) for need in NEEDS])
+
+    state = world.get_state()
+    payoff_cache = state.pop("payoff_cache")
+    arrays["payoff_cache_cells"] = np.array(
+        [board.cell_index(cell) for cell in payoff_cache], dtype=np.int64)
+    arrays["payoff_cache_payoffs"] = np.array(list(payoff_cache.values()),
+                                              dtype=np.float64)
+
+    meta = {
+        "iteration": iteration,
+        "height": board.height,
+        "width": board.width,
+        "players": kind,
+        "parameters": {name: getattr(world, name)
+                       for name in WORLD_PARAMETERS},
+        "world": state,
+        "board_rng": None,
+        "stats": {},
+    }
+    # the board and the world usually share their generator
+    if board.rng is not world.rng:
+        meta["board_rng"] = board.rng.bit_generator.state
+    game = world.game
+    if type(game).__name__ in GAMES:
+        meta["game"] = {"type": type(game).__name__,
+                        "T": game.T, "R": game.R, "P": game.P, "S": game.S}
+
+    if stats:
+        for name, value in stats.get_state().items():
+            if isinstance(value, np.ndarray):
+                arrays["stats/" + name] = value
+            else:
+                meta["stats"][name] = value
+
+    temporary = filename + ".tmp"
+    with open(temporary, "wb") as f:
+        # numpy numbers are written as the python numbers they hold
+        meta = json.dumps(meta, default=lambda value: value.item())
+        np.savez_compressed(f, meta=np.array(meta), **arrays)
+    os.replace(temporary, filename)
+
+
+def load_checkpoint(filename, stats=None, game=None):
+    """rebuilds the world of a checkpoint and restores the statistics (which
+    must be of the same type and settings as when the checkpoint was
+    written). The game is rebuilt from its parameters unless it is given.
+    Returns the world and the iteration at which to continue
+    """
+    with np.load(filename, allow_pickle=False) as checkpoint:
+        arrays = {name: checkpoint[name] for name in checkpoint.files}
+    meta = json.loads(str(arrays.pop("meta")))
+
+    if game is None:
+        if "game" not in meta:
+            print("Error! The game of the checkpoint must be given")
+            quit()
+        parameters = dict(meta["game"])
+        game = GAMES[parameters.pop("type")](**parameters)
+
+    # the generators are created here and set to their saved states below
+    rng = make_rng(0)
+    board_rng = rng
+    if meta["board_rng"] is not None:
+        board_rng = make_rng(0)
+        board_rng.bit_generator.state = meta["board_rng"]
+    board = RectangularGrid(meta["height"], meta["width"], seed=board_rng)
+
+    strategies = [Strategy(int(value)) for value in arrays["strategies"]]
+    if meta["players"] == "population":
+        players = Population(board, strategies, arrays["needs"])
+    elif meta["players"] == "asymmetric":
+        needs = arrays["needs"]
+        players = [AsymmetricPrisonersDilemmaPlayer(
+            strategy, 0, [(int(needs[i]) >> bit) & 1
+                          for bit in range(len(NEEDS))])
+            for i, strategy in enumerate(strategies)]
+    else:
+        players = [PrisonersDilemmaPlayer(strategy)
+                   for strategy in strategies]
+
+    world = World(game, board, players, seed=rng, **meta["parameters"])
+    state = dict(meta["world"])
+    state["payoff_cache"] = {
+        board.index_cell(int(index)): float(payoff)
+        for index, payoff in zip(arrays["payoff_cache_cells"],
+                                 arrays["payoff_cache_payoffs"])}
+    world.set_state([board.index_cell(int(index))
+                     for index in arrays["cells"]],
+                    arrays["payoffs"].tolist(), state)
+    board.set_free_cells(arrays["free_cells"].tolist())
+
+    if stats:
+        state = dict(meta["stats"])
+        for name, value in arrays.items():
+            if name.startswith("stats/"):
+                state[name[len("stats/"):]] = value
+        stats.set_state(state)
+
+    return world, meta["iteration"]
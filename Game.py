@@ -1,5 +1,4 @@
 import abc
-import random
 import numpy as np
 from enum import Enum
 
@@ -30,18 +29,99 @@ class PrisonersDilemmaPlayer(Player):
         super().__init__(strategy)
 
 
+def make_rng(seed=None):
+    """gets a numpy random number generator from a seed. A generator is used
+    as it is, and without a seed a new generator is seeded from the global
+    numpy random state, so that seeding numpy.random keeps making runs
+    reproducible
+    """
+    if isinstance(seed, np.random.Generator):
+        return seed
+    if seed is None:
+        seed = np.random.randint(2 ** 31)
+    return np.random.default_rng(seed)
+
+
+# the Maslow needs of asymmetric players, in the order of their bits when
+# packed into an integer
+NEEDS = ["physio", "safety", "love", "esteem", "fulfill"]
+
+
+def draw_needs(num_players, p, rng=None):
+    """draws the needs of a number of players at once from a random number
+    generator (by default the global numpy random state). Each need is
+    unsatisfied (0) with probability p, and can only be satisfied (1) if the
+    previous need is. Returns an array of 0/1 values per need
+    """
+    if rng is None:
+        rng = np.random
+    satisfied = rng.random((num_players, len(NEEDS))) >= p
+    needs = np.cumprod(satisfied, axis=1)
+    return [needs[:, i] for i in range(len(NEEDS))]
+
+
+def pack_needs(physio, safety, love, esteem, fulfill):
+    """packs (arrays of) the five needs, each 0 or 1, into uint8 bit fields"""
+    needs = np.zeros(np.shape(physio), dtype=np.uint8)
+    for bit, need in enumerate([physio, safety, love, esteem, fulfill]):
+        needs |= (np.asarray(need, dtype=np.uint8) & 1) << bit
+    return needs
+
+
+def need_multipliers(physio, safety, love, esteem, fulfill):
+    """returns the factors by which the needs of a player multiply the
+    payoffs of the prisoners dilemma, indexed by strategy values as
+    [own strategy][opponent strategy]. The needs may be arrays, in which case
+    the last two axes of the result are the strategies
+    """
+    cooperate = Strategy.cooperate.value
+    defect = Strategy.defect.value
+    satisfaction = 1 + (physio + safety + love + esteem + fulfill) / 5
+
+    multipliers = np.zeros(np.shape(physio) + (len(Strategy), len(Strategy)))
+    multipliers[..., cooperate, cooperate] = satisfaction
+    multipliers[..., cooperate, defect] = 1 + (love + esteem) / 2
+    multipliers[..., defect, cooperate] = 2 / satisfaction
+    multipliers[..., defect, defect] = 1 + fulfill
+    return multipliers
+
+
+# the multipliers of all combinations of needs, indexed by the packed needs
+NEED_MULTIPLIERS = need_multipliers(
+    *[(np.arange(2 ** len(NEEDS)) >> bit) & 1 for bit in range(len(NEEDS))]
+).tolist()
+
+
 class AsymmetricPrisonersDilemmaPlayer(Player):
-    def __init__(self, strategy, p):
+    def __init__(self, strategy, p, needs=None, rng=None):
+        """
+        - strategy: the strategy of the player
+        - p: probability that a need is not satisfied
+        - needs: optionally the five needs of the player (see NEEDS),
+          which are otherwise drawn with draw_needs
+        - rng: the random number generator to draw the needs from
+        """
         super().__init__(strategy)
-        self.physio = np.random.choice(np.arange(0, 2), p=[p, 1 - p])
-        self.safety = self.physio * \
-            np.random.choice(np.arange(0, 2), p=[p, 1 - p])
-        self.love = self.safety * \
-            np.random.choice(np.arange(0, 2), p=[p, 1 - p])
-        self.esteem = self.love * \
-            np.random.choice(np.arange(0, 2), p=[p, 1 - p])
-        self.fulfill = self.esteem * \
-            np.random.choice(np.arange(0, 2), p=[p, 1 - p])
+        if needs is None:
+            needs = [need[0] for need in draw_needs(1, p, rng)]
+        needs = [int(need) for need in needs]
+        self.physio, self.safety, self.love, self.esteem, self.fulfill = needs
+        # the needs packed into an integer (see pack_needs)
+        self.needs = int(pack_needs(*needs))
+
+        # the payoff multipliers only depend on the needs, so they are looked
+        # up once rather than computed in every game
+        self.multipliers = NEED_MULTIPLIERS[self.needs]
+
+
+def asymmetric_prisoners_dilemma_players(strategies, p, rng=None):
+    """creates asymmetric players with the given strategies, drawing the
+    needs of all of them at once
+    """
+    needs = draw_needs(len(strategies), p, rng)
+    return [AsymmetricPrisonersDilemmaPlayer(
+        strategy, p, [need[i] for need in needs])
+        for i, strategy in enumerate(strategies)]
 
 
 """
@@ -51,10 +131,43 @@ their payoffs
 
 
 class Game(abc.ABC):
+    # set in games whose payoffs only depend on the strategies: the payoff of
+    # the focal strategy against the opponent strategy, indexed by the values
+    # of the strategies as payoff_matrix[focal][opponent]
+    payoff_matrix = None
+
     @abc.abstractmethod
     def play(self, p1: Player, p2: Player):
         pass
 
+    # override in games whose payoffs also depend on the players
+    def player_payoff_matrix(self, player: Player):
+        """the payoff matrix of a player, None if there is none"""
+        return self.payoff_matrix
+
+    # override if the payoff can be computed without an opponent player
+    def payoff_against(self, player: Player, strategy: Strategy):
+        """the payoff a player receives from playing against an opponent
+        using the given strategy
+        """
+        return self.play(player, Player(strategy))[0]
+
+    def payoff_against_counts(self, strategy, counts, payoff_matrix=None):
+        """the total payoff of a player using the strategy with the given
+        value against neighbors of which counts[s] use the strategy with value
+        s. Only available with a payoff matrix, which is the one of the game
+        unless given (e.g. the one of a player); counts may be (NumPy) arrays
+        of counts, in which case the payoffs are computed element-wise, and
+        so can the entries of the payoff matrix
+        """
+        if payoff_matrix is None:
+            payoff_matrix = self.payoff_matrix
+        payoffs = payoff_matrix[strategy]
+        payoff = payoffs[0] * counts[0]
+        for s in range(1, len(payoffs)):
+            payoff = payoff + payoffs[s] * counts[s]
+        return payoff
+
 
 class PrisonersDilemma(Game):
     def __init__(self, T, R, P, S):
@@ -69,37 +182,54 @@ class PrisonersDilemma(Game):
         self.P = P
         self.S = S
 
+        self.payoff_matrix = [[None, None], [None, None]]
+        cooperate = Strategy.cooperate.value
+        defect = Strategy.defect.value
+        self.payoff_matrix[cooperate][cooperate] = R
+        self.payoff_matrix[cooperate][defect] = S
+        self.payoff_matrix[defect][cooperate] = T
+        self.payoff_matrix[defect][defect] = P
+
     def play(self, p1: Player, p2: Player):
-        if p1.strategy == Strategy.cooperate:
-            if p2.strategy == Strategy.cooperate:
-                return (self.R, self.R)
-            elif p2.strategy == Strategy.defect:
-                return (self.S, self.T)
-        elif p1.strategy == Strategy.defect:
-            if p2.strategy == Strategy.cooperate:
-                return (self.T, self.S)
-            elif p2.strategy == Strategy.defect:
-                return (self.P, self.P)
-        else:
-            print("Player strategies not well defined!")
-            quit()
+        s1 = p1.strategy.value
+        s2 = p2.strategy.value
+        return (self.payoff_matrix[s1][s2], self.payoff_matrix[s2][s1])
+
+    def payoff_against(self, player: Player, strategy: Strategy):
+        return self.payoff_matrix[player.strategy.value][strategy.value]
 
 
 class AsymmetricPrisonersDilemma(PrisonersDilemma):
+    def __init__(self, T, R, P, S):
+        super().__init__(T, R, P, S)
+        # the payoffs also depend on the needs of the players, through the
+        # multipliers of the payoffs of this matrix
+        self.base_payoff_matrix = self.payoff_matrix
+        self.payoff_matrix = None
+        # the payoff matrices of the players by their packed needs, computed
+        # once for every combination of needs (see NEED_MULTIPLIERS)
+        self.need_payoff_matrices = [
+            [[payoff * multiplier for payoff, multiplier in zip(
+                payoffs, row)] for payoffs, row in zip(
+                self.base_payoff_matrix, multipliers)]
+            for multipliers in NEED_MULTIPLIERS]
+
     def play(self, p1: Player, p2: Player):
-        if p1.strategy == Strategy.cooperate:
-            if p2.strategy == Strategy.cooperate:
-                return (self.R*(1+(p1.physio + p1.safety + p1.love + p1.esteem + p1.fulfill)/5),
-                        self.R*(1+(p2.physio + p2.safety + p2.love + p2.esteem + p2.fulfill)/5))
-            elif p2.strategy == Strategy.defect:
-                return (self.S*(1+(p1.love + p1.esteem)/2),
-                        self.T*(2/(1+(p2.physio + p2.safety + p2.love + p2.esteem + p2.fulfill)/5)))
-        elif p1.strategy == Strategy.defect:
-            if p2.strategy == Strategy.cooperate:
-                return (self.T*(2/(1+(p1.physio + p1.safety + p1.love + p1.esteem + p1.fulfill)/5)),
-                        self.S*(1+(p2.love + p2.esteem)/2))
-            elif p2.strategy == Strategy.defect:
-                return (self.P * (1 + p1.fulfill), self.P * (1 + p2.fulfill))
-        else:
-            print("Player strategies not well defined!")
-            exit()
+        s1 = p1.strategy.value
+        s2 = p2.strategy.value
+        return (self.base_payoff_matrix[s1][s2] * p1.multipliers[s1][s2],
+                self.base_payoff_matrix[s2][s1] * p2.multipliers[s2][s1])
+
+    def payoff_against(self, player: Player, strategy: Strategy):
+        s1 = player.strategy.value
+        s2 = strategy.value
+        return self.base_payoff_matrix[s1][s2] * player.multipliers[s1][s2]
+
+    def player_payoff_matrix(self, player: Player):
+        return self.need_payoff_matrices[player.needs]
+
+    def payoff_matrices(self, multipliers):
+        """the payoff matrices of many players at once, given an array of
+        their multipliers whose last two axes are the strategies
+        """
+        return np.asarray(self.base_payoff_matrix) * np.asarray(multipliers)
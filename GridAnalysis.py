@@ -0,0 +1,132 @@
+import numpy as np
+from VectorizedWorld import EMPTY
+
+"""
+Spatial analysis of the strategy grid of a world on a rectangular board with
+periodic boundaries (see get_strategy_grid), vectorized so that it can be
+done every round of large simulations.
+"""
+
+
+def label_clusters(strategies):
+    """labels the clusters of players: groups of players using the same
+    strategy which are connected through their play neighborhoods (above,
+    below, left, right, across the periodic boundaries). Returns an array
+    holding, for every occupied cell, the lowest flat index of a cell in its
+    cluster, and -1 in empty cells.
+
+    This is a union-find over all pairs of neighboring players with the same
+    strategy, done for all pairs at once: every pass links the root of the
+    higher labelled cluster to the lower one and then compresses the paths
+    to the roots, which takes a few passes even on large grids.
+    """
+    index = np.arange(strategies.size).reshape(strategies.shape)
+    occupied = strategies != EMPTY
+
+    # pairs of cells with the same strategy to the right and below
+    firsts = []
+    seconds = []
+    for axis in (0, 1):
+        neighbors = np.roll(index, -1, axis=axis)
+        same = occupied & (strategies == np.roll(strategies, -1, axis=axis))
+        firsts.append(index[same])
+        seconds.append(neighbors[same])
+    firsts = np.concatenate(firsts)
+    seconds = np.concatenate(seconds)
+
+    parents = index.reshape(-1).copy()
+    while True:
+        first_roots = parents[firsts]
+        second_roots = parents[seconds]
+        linked = first_roots != second_roots
+        if not linked.any():
+            break
+        first_roots = first_roots[linked]
+        second_roots = second_roots[linked]
+        np.minimum.at(parents, np.maximum(first_roots, second_roots),
+                      np.minimum(first_roots, second_roots))
+
+        # parents never have a higher index than their children, so jumping
+        # to the grandparents until nothing changes reaches the roots
+        while True:
+            grandparents = parents[parents]
+            if (grandparents == parents).all():
+                break
+            parents = grandparents
+
+    return np.where(occupied, parents.reshape(strategies.shape), -1)
+
+
+def cluster_sizes(strategies, labels, strategy):
+    """ returns the sizes of the clusters of players using a strategy """
+    sizes = np.bincount(labels[strategies == strategy.value])
+    return sizes[sizes > 0]
+
+
+def distance_bins(height, width):
+    """returns the distance between cell (0, 0) and every cell across the
+    periodic boundaries, rounded to the nearest integer
+    """
+    rows = np.arange(height)
+    columns = np.arange(width)
+    rows = np.minimum(rows, height - rows)
+    columns = np.minimum(columns, width - columns)
+    return np.rint(np.hypot(rows[:, np.newaxis], columns)).astype(np.int64)
+
+
+def cross_correlation(first, second):
+    """returns the mean of first[x] * second[x + d] over all cells x, for
+    every shift d across the periodic boundaries, computed with FFTs
+    """
+    correlation = np.fft.irfft2(np.conj(np.fft.rfft2(first)) *
+                                np.fft.rfft2(second), s=first.shape)
+    return correlation / first.size
+
+
+def pair_correlation(strategies, first_strategy, second_strategy, bins=None):
+    """returns the spatial correlation between players using two strategies
+    as a function of the distance (rounded to integers): the probability of
+    finding a player using second_strategy at that distance from a player
+    using first_strategy, relative to what it would be if the players were
+    placed at random (1 for no correlation, above 1 for players drawn
+    together, 0 if there are no such players). bins are the distance_bins of
+    the grid
+    """
+    if bins is None:
+        bins = distance_bins(*strategies.shape)
+    first = (strategies == first_strategy.value).astype(np.float64)
+    second = (strategies == second_strategy.value).astype(np.float64)
+    densities = first.mean() * second.mean()
+    if densities == 0:
+        return np.zeros(bins.max() + 1)
+
+    correlation = cross_correlation(first, second)
+    sums = np.bincount(bins.reshape(-1), correlation.reshape(-1))
+    return sums / np.bincount(bins.reshape(-1)) / densities
+
+
+def segregation_index(strategies):
+    """returns how much more often neighboring players (in the play
+    neighborhood) use the same strategy than they would if the strategies
+    were shuffled among the players: 0 for well mixed strategies, 1 if
+    players only neighbor players using their strategy, negative if unlike
+    neighbors are favored. Returns 0 if no players are neighbors or all use
+    the same strategy
+    """
+    occupied = strategies != EMPTY
+    num_pairs = 0
+    num_like_pairs = 0
+    for axis in (0, 1):
+        neighbors = np.roll(strategies, -1, axis=axis)
+        pairs = occupied & (neighbors != EMPTY)
+        num_pairs += np.count_nonzero(pairs)
+        num_like_pairs += np.count_nonzero(pairs & (strategies == neighbors))
+
+    counts = np.bincount(strategies[occupied])
+    num_players = counts.sum()
+    if num_pairs == 0 or counts.max() == num_players:
+        return 0.0
+    expected = (counts * (counts - 1)).sum() / (num_players *
+                                               (num_players - 1))
+
+    return float((num_like_pairs / num_pairs - expected) / (1 - expected))
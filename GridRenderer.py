@@ -0,0 +1,119 @@
+import os
+import numpy as np
+import pygame as pg
+
+"""
+Renders the strategy grid of a rectangular board (see get_strategy_grid) as
+frames built in one vectorized pass: every cell becomes a square of pixels
+colored by its strategy. The frames are shown in a window, or written
+without opening a window as PNG images or as a raw stream of RGB pixels,
+which can be turned into a video, e.g. with
+    ffmpeg -f rawvideo -pix_fmt rgb24 -s <width>x<height> -i frames.rgb
+      movie.mp4
+where the width and height are those of the frames in pixels.
+"""
+
+# output modes of the renderer
+MODES = ("window", "png", "raw")
+
+# colors of the cells indexed by strategy value + 1: empty, cooperate, defect
+COLORS = np.array([(255, 255, 255), (0, 0, 255), (255, 0, 0)],
+                  dtype=np.uint8)
+
+
+def frame_pixels(strategies, cell_size):
+    """returns the frame of a strategy grid as an array of RGB pixels
+    (rows, columns, colors)
+    """
+    pixels = COLORS[strategies.astype(np.int64) + 1]
+    if cell_size > 1:
+        pixels = np.repeat(np.repeat(pixels, cell_size, axis=0), cell_size,
+                           axis=1)
+    return pixels
+
+
+class GridRenderer():
+    def __init__(self, mode="window", cell_size=16, frame_skip=1, path=None):
+        """
+        - mode: where the frames go (see MODES): a window, one PNG image per
+          frame or a raw stream of RGB pixels
+        - cell_size: the width and height of a cell in pixels
+        - frame_skip: only every that many calls of render draw a frame
+        - path: for png, the file name pattern of the images with a field
+          for the frame number (by default frames/frame_%06d.png); for raw,
+          the file the pixels are appended to (by default frames.rgb)
+        """
+        if mode not in MODES:
+            print("Error! Unknown render mode", mode, "- use one of", MODES)
+            quit()
+        if path is None:
+            path = "frames/frame_%06d.png" if mode == "png" else "frames.rgb"
+
+        self.mode = mode
+        self.cell_size = cell_size
+        self.frame_skip = frame_skip
+        self.path = path
+        self.num_calls = 0
+        self.num_frames = 0
+        self.screen = None
+        self.stream = None
+        self.closed = False
+
+    def skips_next(self):
+        """tells whether the next call of render will be skipped, so that
+        the strategy grid of a skipped frame need not be built
+        """
+        return self.closed or self.num_calls % self.frame_skip != 0
+
+    def render(self, strategies):
+        """draws a frame of a strategy grid, unless it is skipped or the
+        window was closed (the grid may then be None)
+        """
+        skipped = self.skips_next()
+        self.num_calls += 1
+        if skipped:
+            return
+
+        pixels = frame_pixels(strategies, self.cell_size)
+        if self.mode == "window":
+            self.show(pixels)
+        elif self.mode == "png":
+            filename = self.path % self.num_frames
+            directory = os.path.dirname(filename)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # surfaces are indexed by column first
+            pg.image.save(pg.surfarray.make_surface(pixels.swapaxes(0, 1)),
+                          filename)
+        else:
+            if self.stream is None:
+                self.stream = open(self.path, "wb")
+            self.stream.write(pixels.tobytes())
+        self.num_frames += 1
+
+    def show(self, pixels):
+        """ shows the pixels of a frame in the window, opening it if needed """
+        if self.screen is None:
+            pg.init()
+            self.screen = pg.display.set_mode(
+                (pixels.shape[1], pixels.shape[0]))
+            pg.display.set_caption("Strategy Evolution Simulation")
+
+        # proper closing of the window....
+        for event in pg.event.get():
+            if event.type == pg.QUIT:
+                self.close()
+                return
+
+        pg.surfarray.blit_array(self.screen, pixels.swapaxes(0, 1))
+        pg.display.update()
+
+    def close(self):
+        """ closes the window or the raw stream """
+        if self.screen is not None:
+            pg.quit()
+            self.screen = None
+        if self.stream is not None:
+            self.stream.close()
+            self.stream = None
+        self.closed = True
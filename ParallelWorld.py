@@ -0,0 +1,325 @@
+import weakref
+import numpy as np
+from multiprocessing import Process, Pipe, shared_memory
+from Game import Strategy
+from VectorizedWorld import (
+    VectorizedWorld,
+    EMPTY,
+    STREAM_NOISE,
+    STREAM_NOISE1,
+    counter_uniform,
+    neighbor_counts,
+    count_strategies,
+    migration_moves,
+    resolve_migration,
+    apply_migration,
+    payoff_field,
+    imitation_strategies,
+)
+
+"""
+The synchronous update of VectorizedWorld split among several processes.
+
+The grid is cut into horizontal strips, one per worker process, and all
+arrays describing the grid live in shared memory. A round is carried out
+in phases separated by barriers (counts, migration moves, conflict
+resolution, applying the moves, payoffs, imitation and noise). In each phase
+a worker reads its strip plus a halo of max(1, M) rows above and below it,
+which holds everything the cells of the strip depend on, and only writes
+the rows of its strip. Noise 2 moves players anywhere on the grid, so it is
+done by the main process between rounds.
+
+As the random numbers of a synchronous round only depend on the global
+index of each cell, the results are identical to those of
+VectorizedWorld(update="synchronous") with the same seed, whatever the
+number of workers.
+"""
+
+# the arrays shared with the workers, as (name, dtype, number of layers)
+SHARED_ARRAYS = [
+    ("strategies", np.int8, 0),
+    ("player_ids", np.int32, 0),
+    ("counts", np.int8, len(Strategy)),
+    ("moves", np.int16, 0),
+    ("recorded_payoffs", np.float64, 0),
+    ("winners", np.int16, 0),
+    ("new_strategies", np.int8, 0),
+    ("new_player_ids", np.int32, 0),
+    ("new_recorded_payoffs", np.float64, 0),
+    ("payoffs", np.float64, 0),
+]
+
+
+def attach_arrays(specs):
+    """attaches to the shared memory blocks described by specs, a list of
+    (name, memory name, shape, dtype), and returns the memory blocks and
+    the arrays by name
+    """
+    memories = []
+    arrays = {}
+    for name, memory_name, shape, dtype in specs:
+        memory = shared_memory.SharedMemory(name=memory_name)
+        memories.append(memory)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+
+    return memories, arrays
+
+
+def window_matrices(matrix, player_matrices, player_ids):
+    """ returns the payoff matrices of the cells (see cell_matrices) """
+    if player_matrices is None:
+        return matrix
+    return np.moveaxis(player_matrices[player_ids], (-2, -1), (0, 1))
+
+
+def strip_phase(phase, key, arrays, world, rows, window, index):
+    """carries out one phase of a synchronous round for a strip of rows,
+    reading the window of rows around it (with the halo). The imitation
+    phase returns the number of players using each strategy in the strip
+    """
+    inner = slice(world["halo"], world["halo"] + rows.stop - rows.start)
+    offsets = world["offsets"]
+    matrix = world["matrix"]
+    player_matrices = world["player_matrices"]
+
+    def read(name):
+        return arrays[name][..., window, :]
+
+    if phase == "counts":
+        counts = neighbor_counts(read("strategies"))
+        arrays["counts"][:, rows] = counts[:, inner]
+
+    elif phase == "moves":
+        moves, recorded_payoffs = migration_moves(
+            read("strategies"), read("counts"),
+            window_matrices(matrix, player_matrices, read("player_ids")),
+            offsets, index, key)
+        arrays["moves"][rows] = moves[inner]
+        arrays["recorded_payoffs"][rows] = recorded_payoffs[inner]
+
+    elif phase == "resolve":
+        winners = resolve_migration(read("moves"), offsets, index, key)
+        arrays["winners"][rows] = winners[inner]
+
+    elif phase == "apply":
+        strategies, player_ids, recorded_payoffs = apply_migration(
+            [read("strategies"), read("player_ids"),
+             read("recorded_payoffs")],
+            read("moves"), read("winners"), offsets, [EMPTY, -1, 0])
+        arrays["new_strategies"][rows] = strategies[inner]
+        arrays["new_player_ids"][rows] = player_ids[inner]
+        arrays["new_recorded_payoffs"][rows] = recorded_payoffs[inner]
+
+    elif phase == "stay":
+        # without migration the players stay where they are
+        arrays["new_strategies"][rows] = arrays["strategies"][rows]
+        arrays["new_player_ids"][rows] = arrays["player_ids"][rows]
+
+    elif phase == "payoffs":
+        strategies = read("new_strategies")
+        payoffs = payoff_field(
+            strategies, neighbor_counts(strategies),
+            window_matrices(matrix, player_matrices, read("new_player_ids")))
+        arrays["payoffs"][rows] = payoffs[inner]
+
+    elif phase == "imitate":
+        strategies = read("new_strategies")
+        occupied = strategies != EMPTY
+        noisy = occupied & (counter_uniform(key, STREAM_NOISE, index)
+                            < world["r"])
+        new_strategies = strategies
+        if world["imitation"]:
+            payoffs = read("payoffs")
+            own_payoffs = payoffs
+            if world["migration"]:
+                own_payoffs = read("new_recorded_payoffs")
+            new_strategies = np.where(noisy, strategies, imitation_strategies(
+                strategies, payoffs, own_payoffs))
+        if world["noise1"]:
+            reset = np.where(
+                counter_uniform(key, STREAM_NOISE1, index) < world["q"],
+                Strategy.cooperate.value, Strategy.defect.value)
+            new_strategies = np.where(noisy, reset, new_strategies)
+        arrays["strategies"][rows] = new_strategies[inner]
+        arrays["player_ids"][rows] = arrays["new_player_ids"][rows]
+        return count_strategies(new_strategies[inner])
+
+
+def strip_worker(connection, specs, world, rows):
+    """runs the phases of the synchronous rounds sent by the main process
+    for a strip of rows, until it receives None
+    """
+    memories, arrays = attach_arrays(specs)
+    halo = world["halo"]
+    window = np.arange(rows.start - halo, rows.stop + halo) % world["height"]
+    index = window[:, np.newaxis] * world["width"] + \
+        np.arange(world["width"])
+
+    while True:
+        message = connection.recv()
+        if message is None:
+            break
+        phase, key = message
+        connection.send(
+            strip_phase(phase, key, arrays, world, rows, window, index))
+
+    del arrays
+    for memory in memories:
+        memory.close()
+
+
+def release_resources(connections, workers, memories):
+    """stops the worker processes and frees the shared memory of a
+    ParallelWorld. Run by close, or when the world is garbage collected or
+    the interpreter exits without closing it (e.g. after an exception)
+    """
+    for connection in connections:
+        try:
+            connection.send(None)
+        except OSError:
+            # the worker has already stopped
+            pass
+    for worker in workers:
+        worker.join(timeout=10)
+        if worker.is_alive():
+            worker.terminate()
+            worker.join()
+
+    for memory in memories:
+        memory.unlink()
+        try:
+            memory.close()
+        except BufferError:
+            # arrays of a collected world still use the memory, which is
+            # unmapped once they are freed
+            pass
+
+
+class ParallelWorld(VectorizedWorld):
+    def __init__(self, game, board, players, r=0, q=0, noise1=False,
+                 noise2=False, imitation=False, migration=False, M=0,
+                 num_workers=2, seed=None):
+        """
+        takes the same arguments as VectorizedWorld, always updating
+        synchronously, and
+        - num_workers: the number of processes among which the rows of the
+          grid are split
+        Call close (or use the world in a with statement) to stop the
+        workers and free the shared memory.
+        """
+        super().__init__(game, board, players, r, q, noise1, noise2,
+                         imitation, migration, M, update="synchronous",
+                         seed=seed)
+        if num_workers < 1 or num_workers > self.height:
+            print("Error! The number of workers must be between 1 and the",
+                  "height of the grid")
+            quit()
+
+        # the workers and the shared memory are released even if the world
+        # is not closed
+        self.memories = []
+        self.connections = []
+        self.workers = []
+        self.release = weakref.finalize(self, release_resources,
+                                        self.connections, self.workers,
+                                        self.memories)
+
+        # move the arrays of the world into shared memory
+        specs = []
+        arrays = {}
+        for name, dtype, layers in SHARED_ARRAYS:
+            shape = (self.height, self.width)
+            if layers:
+                shape = (layers,) + shape
+            memory = shared_memory.SharedMemory(
+                create=True, size=max(1, int(np.prod(shape)) *
+                                      np.dtype(dtype).itemsize))
+            self.memories.append(memory)
+            specs.append((name, memory.name, shape, dtype))
+            arrays[name] = np.ndarray(shape, dtype=dtype, buffer=memory.buf)
+        arrays["strategies"][...] = self.strategies
+        arrays["player_ids"][...] = self.player_ids
+        arrays["counts"][...] = self.counts
+        self.arrays = arrays
+        self.strategies = arrays["strategies"]
+        self.player_ids = arrays["player_ids"]
+        self.counts = arrays["counts"]
+
+        world = {
+            "height": self.height,
+            "width": self.width,
+            "halo": max(1, M),
+            "offsets": self.offsets,
+            "matrix": self.matrix,
+            "player_matrices": self.player_matrices,
+            "r": r,
+            "q": q,
+            "noise1": noise1,
+            "imitation": imitation,
+            "migration": migration and bool(self.offsets),
+        }
+        for strip in np.array_split(np.arange(self.height), num_workers):
+            rows = slice(int(strip[0]), int(strip[-1]) + 1)
+            connection, worker_connection = Pipe()
+            worker = Process(target=strip_worker, daemon=True,
+                             args=(worker_connection, specs, world, rows))
+            worker.start()
+            self.connections.append(connection)
+            self.workers.append(worker)
+
+    def run_phase(self, phase, key=0):
+        """carries out a phase in all workers, waits until they finish and
+        returns their replies
+        """
+        for connection in self.connections:
+            connection.send((phase, key))
+        return [connection.recv() for connection in self.connections]
+
+    def synchronous_round(self):
+        """carries out one round with the rule of
+        VectorizedWorld.synchronous_round, split among the workers
+        """
+        key = int(self.rng.integers(2 ** 64, dtype=np.uint64))
+
+        if self.migration and self.offsets:
+            self.run_phase("moves", key)
+            self.run_phase("resolve", key)
+            self.run_phase("apply", key)
+        else:
+            self.run_phase("stay")
+        if self.imitation:
+            self.run_phase("payoffs")
+
+        # players resetting their location are chosen on the grid after
+        # migration, before imitation changes it
+        if self.noise2:
+            occupied = self.arrays["new_strategies"] != EMPTY
+            noisy = occupied & (counter_uniform(key, STREAM_NOISE, self.index)
+                                < self.r)
+        strip_counts = self.run_phase("imitate", key)
+        self.strategy_counts = np.sum(strip_counts, axis=0).tolist()
+
+        if self.noise2:
+            strategies, player_ids = self._synchronous_noise2(
+                self.strategies, self.player_ids, np.flatnonzero(noisy), key)
+            self.strategies[...] = strategies
+            self.player_ids[...] = player_ids
+        self.run_phase("counts")
+
+    def close(self):
+        """ stops the workers and frees the shared memory """
+        if not self.release.alive:
+            return
+
+        # keep copies of the arrays, which outlive the shared memory
+        self.strategies = self.strategies.copy()
+        self.player_ids = self.player_ids.copy()
+        self.counts = self.counts.copy()
+        self.arrays = None
+        self.release()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
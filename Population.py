@@ -0,0 +1,133 @@
+import numpy as np
+from Game import Strategy, NEED_MULTIPLIERS, draw_needs, pack_needs
+
+"""
+A compact container for large populations of players. Instead of one Python
+object per player, the attributes of all players are held in typed arrays:
+- strategies: int8 strategy values
+- cells: int32 cell indices on the board (-1 if not on the board)
+- payoffs: float64 payoffs
+- needs: the five Maslow needs of asymmetric players packed into the bits
+  of one uint8 (see NEEDS in Game.py)
+
+PlayerView objects give access to a single player with the same attributes
+as Player (and AsymmetricPrisonersDilemmaPlayer), so that code written for
+player objects keeps working on a population.
+"""
+
+# strategies indexed by their value
+STRATEGIES = tuple(sorted(Strategy, key=lambda strategy: strategy.value))
+
+
+class Population():
+    def __init__(self, board, strategies, needs=None):
+        """
+        - board: the board on which the players live, used to convert cells
+          to cell indices and back
+        - strategies: a sequence of the strategies (or strategy values) of
+          the players
+        - needs: optional packed needs of the players (see pack_needs)
+        """
+        self.board = board
+        self.size = len(strategies)
+        self.strategies = np.array(
+            [getattr(strategy, "value", strategy) for strategy in strategies],
+            dtype=np.int8)
+        self.cells = np.full(self.size, -1, dtype=np.int32)
+        self.payoffs = np.zeros(self.size)
+        if needs is None:
+            self.needs = np.zeros(self.size, dtype=np.uint8)
+        else:
+            self.needs = np.asarray(needs, dtype=np.uint8).copy()
+
+    @classmethod
+    def asymmetric(cls, board, strategies, p, rng=None):
+        """creates a population of asymmetric prisoners dilemma players,
+        drawing the needs of all of them at once (see draw_needs)
+        """
+        return cls(board, strategies,
+                   pack_needs(*draw_needs(len(strategies), p, rng)))
+
+    def multipliers(self):
+        """returns the payoff multipliers of all players (see
+        need_multipliers), as an array whose last two axes are the strategies
+        """
+        return np.asarray(NEED_MULTIPLIERS)[self.needs]
+
+    def __len__(self):
+        return self.size
+
+    def players(self):
+        """ returns a list of views on all players of the population """
+        return [PlayerView(self, i) for i in range(self.size)]
+
+    def get_num_players_with_strategy(self, strat):
+        """ returns the number of players using a strategy """
+        return int(np.count_nonzero(self.strategies == strat.value))
+
+    def nbytes(self):
+        """ returns the memory used by the arrays of the population """
+        return (self.strategies.nbytes + self.cells.nbytes +
+                self.payoffs.nbytes + self.needs.nbytes)
+
+
+class PlayerView():
+    """a player of a population, with the attributes of a Player object which
+    read from and write to the arrays of the population
+    """
+    __slots__ = ("population", "id")
+
+    def __init__(self, population, id):
+        self.population = population
+        self.id = id
+
+    @property
+    def strategy(self):
+        return STRATEGIES[self.population.strategies[self.id]]
+
+    @strategy.setter
+    def strategy(self, strategy):
+        self.population.strategies[self.id] = strategy.value
+
+    @property
+    def cell(self):
+        index = self.population.cells[self.id]
+        if index < 0:
+            return None
+        return self.population.board.index_cell(int(index))
+
+    @cell.setter
+    def cell(self, cell):
+        if cell is None:
+            self.population.cells[self.id] = -1
+        else:
+            self.population.cells[self.id] = \
+                self.population.board.cell_index(cell)
+
+    @property
+    def payoff(self):
+        return float(self.population.payoffs[self.id])
+
+    @payoff.setter
+    def payoff(self, payoff):
+        self.population.payoffs[self.id] = payoff
+
+    def _need(bit):
+        def get(self):
+            return int(self.population.needs[self.id] >> bit) & 1
+        return property(get)
+
+    physio = _need(0)
+    safety = _need(1)
+    love = _need(2)
+    esteem = _need(3)
+    fulfill = _need(4)
+    del _need
+
+    @property
+    def needs(self):
+        return int(self.population.needs[self.id])
+
+    @property
+    def multipliers(self):
+        return NEED_MULTIPLIERS[self.population.needs[self.id]]
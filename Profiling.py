@@ -0,0 +1,154 @@
+import time
+import functools
+
+"""
+Optional instrumentation of a world, to find out where the time of the
+rounds goes. A RoundProfiler attached to a world replaces some methods of
+the world, its board and its game by wrappers on the objects themselves
+(the classes are left alone), which time the phases of the update and count
+the basic operations. Worlds without a profiler run the original methods,
+at no cost.
+
+The counters are not locked, so they can miss a few operations when the
+synchronous update of World is split among threads. A game shared by several
+worlds is profiled for all of them.
+"""
+
+# the methods timed as phases, by phase name. Phases whose method a world
+# does not have (e.g. VectorizedWorld) are left out
+PHASES = {
+    "round": ("world", "round"),
+    "play": ("world", "play_with_neighbors"),
+    "migration": ("world", "migration_update"),
+    "imitation": ("world", "imitation_update"),
+    "noise1": ("world", "noise1_update"),
+    "noise2": ("world", "noise2_update"),
+    "synchronous migration": ("world", "migration_target"),
+    "synchronous imitation": ("world", "imitation_choice"),
+    "draw": ("board", "draw"),
+}
+
+# the methods counted, by counter name
+COUNTERS = {
+    "payoff_evaluations": [("world", "payoff_in_cell"),
+                           ("world", "fresh_payoff"),
+                           ("game", "payoff_against_counts")],
+    "board_writes": [("board", "assign_player_to_cell")],
+    "neighbor_queries": [("board", "get_cells_in_play_neighborhood"),
+                         ("board", "get_players_in_play_neighborhood"),
+                         ("board", "get_strategy_counts_in_play_neighborhood"),
+                         ("board",
+                          "get_empty_cells_in_migration_neighboorhood")],
+}
+
+# the methods whose results are counted: every empty cell scored by a
+# player considering where to migrate is a simulated migration
+RESULT_COUNTERS = {
+    "simulated_migrations": [("board",
+                              "get_empty_cells_in_migration_neighboorhood")],
+}
+
+
+class RoundProfiler():
+    def __init__(self):
+        """
+        cumulative times (in seconds) and numbers of calls of the phases,
+        and counts of the operations, since the profiler was attached
+        """
+        self.times = {}
+        self.calls = {}
+        self.counts = {}
+        self.wrapped = []
+        self.last_metrics = {}
+
+    def attach(self, world):
+        """ starts profiling a world (and its board and game) """
+        owners = {"world": world, "board": world.board, "game": world.game}
+
+        for phase, (owner, name) in PHASES.items():
+            if hasattr(owners[owner], name):
+                self.times[phase] = 0.0
+                self.calls[phase] = 0
+                self.wrap(owners[owner], name, self.timed(phase))
+        for counter, methods in COUNTERS.items():
+            self.counts[counter] = 0
+            for owner, name in methods:
+                if hasattr(owners[owner], name):
+                    self.wrap(owners[owner], name, self.counted(counter))
+        for counter, methods in RESULT_COUNTERS.items():
+            self.counts[counter] = 0
+            for owner, name in methods:
+                if hasattr(owners[owner], name):
+                    self.wrap(owners[owner], name,
+                              self.counted_results(counter))
+
+    def detach(self):
+        """ stops profiling, restoring the original methods """
+        for owner, name, previous in reversed(self.wrapped):
+            if previous is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, previous)
+        self.wrapped = []
+
+    def wrap(self, owner, name, wrapper):
+        # the wrapper is stored on the object, hiding the method of its class
+        # (or an earlier wrapper, which is restored when detaching)
+        method = getattr(owner, name)
+        previous = vars(owner).get(name)
+        if previous is not None and not any(
+                wrapped[0] is owner and wrapped[1] == name
+                for wrapped in self.wrapped):
+            print("Error! Cannot profile", name, "which is already replaced")
+            quit()
+        setattr(owner, name, functools.wraps(method)(wrapper(method)))
+        self.wrapped.append((owner, name, previous))
+
+    def timed(self, phase):
+        def wrapper(method):
+            def timed_method(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return method(*args, **kwargs)
+                finally:
+                    self.times[phase] += time.perf_counter() - start
+                    self.calls[phase] += 1
+            return timed_method
+        return wrapper
+
+    def counted(self, counter):
+        def wrapper(method):
+            def counted_method(*args, **kwargs):
+                self.counts[counter] += 1
+                return method(*args, **kwargs)
+            return counted_method
+        return wrapper
+
+    def counted_results(self, counter):
+        def wrapper(method):
+            def counted_method(*args, **kwargs):
+                result = method(*args, **kwargs)
+                self.counts[counter] += len(result)
+                return result
+            return counted_method
+        return wrapper
+
+    def metrics(self):
+        """returns the cumulative metrics as a flat dictionary: the time and
+        number of calls of each phase ("time/<phase>", "calls/<phase>") and
+        the counts of the operations
+        """
+        metrics = {}
+        for phase in self.times:
+            metrics["time/" + phase] = self.times[phase]
+            metrics["calls/" + phase] = self.calls[phase]
+        metrics.update(self.counts)
+        return metrics
+
+    def round_metrics(self):
+        """ returns the metrics accumulated since the last call """
+        metrics = self.metrics()
+        round_metrics = {name: value - self.last_metrics.get(name, 0)
+                         for name, value in metrics.items()}
+        self.last_metrics = metrics
+        return round_metrics
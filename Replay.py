@@ -0,0 +1,224 @@
+import os
+import json
+import zlib
+import struct
+import numpy as np
+from SimulationStatistics import SimulationStatistics
+
+"""
+A replay log of a simulation, from which the board can be redrawn at any
+round without simulating again.
+
+The log records a frame after every round (and one of the initial state):
+the strategy value (-1 if empty) and the player (its index among the
+players given to the world, -1 if empty) of every cell.
+Most frames are stored as the cells which changed since the previous frame
+(strategy flips from imitation and noise 1, and moves from migration and
+noise 2), and every keyframe_every frames the whole board is stored, so that
+any frame can be rebuilt from the keyframe before it.
+
+The log is written to two append-only files:
+- <filename>: a header (MAGIC, the length of a JSON description and the
+  description) followed by the zlib compressed frames
+- <filename>.index: for every frame, its offset and length in the log, the
+  iteration and whether it is a keyframe (see INDEX_DTYPE)
+"""
+
+MAGIC = b"STRATEGY-EVOLUTION-REPLAY\n"
+
+INDEX_DTYPE = np.dtype([("offset", "<i8"), ("length", "<i8"),
+                        ("iteration", "<i8"), ("keyframe", "u1")])
+
+
+def board_shape(board):
+    """ gets the shape of the strategy grid of a board """
+    if hasattr(board, "height"):
+        return (board.height, board.width)
+    return (board.N,)
+
+
+def cell_state(world):
+    """returns copies of the strategy values and player indices (see
+    player_ids in World and VectorizedWorld) in all cells of a world, as flat
+    arrays
+    """
+    return (world.get_strategy_grid().reshape(-1).astype(np.int8),
+            world.player_ids.reshape(-1).astype(np.int32))
+
+
+class ReplayRecorder(SimulationStatistics):
+    def __init__(self, filename, keyframe_every=100):
+        """
+        - filename: the file of the log (see above), replaced if it exists
+        - keyframe_every: the number of frames between keyframes, trading
+          the size of the log for the time to seek to a frame
+        """
+        self.filename = filename
+        self.keyframe_every = keyframe_every
+        self.log = None
+        self.index = None
+        self.num_frames = 0
+        self.strategies = None
+        self.players = None
+
+    def record_stats(self, world, iteration):
+        if self.log is None:
+            self.start(world)
+
+        strategies, players = cell_state(world)
+        keyframe = self.num_frames % self.keyframe_every == 0
+        if keyframe:
+            payload = strategies.tobytes() + players.tobytes()
+        else:
+            cells = np.flatnonzero((strategies != self.strategies) |
+                                   (players != self.players))
+            payload = (cells.astype(np.int32).tobytes() +
+                       strategies[cells].tobytes() + players[cells].tobytes())
+        payload = zlib.compress(payload)
+
+        self.index.write(np.array(
+            [(self.log.tell(), len(payload), iteration, keyframe)],
+            dtype=INDEX_DTYPE).tobytes())
+        self.log.write(payload)
+        if keyframe:
+            # the log is complete up to here should the simulation crash
+            self.log.flush()
+            self.index.flush()
+
+        self.strategies = strategies
+        self.players = players
+        self.num_frames += 1
+
+    def start(self, world):
+        """ opens the log and writes its header """
+        description = json.dumps({
+            "shape": board_shape(world.board),
+            "num_players": len(world.players),
+            "keyframe_every": self.keyframe_every,
+        }).encode()
+        self.log = open(self.filename, "wb")
+        self.index = open(self.filename + ".index", "wb")
+        self.log.write(MAGIC + struct.pack("<I", len(description)) +
+                       description)
+
+    def print_results(self):
+        """ closes the log and returns its file name """
+        if self.log is not None:
+            self.log.close()
+            self.index.close()
+            self.log = None
+        return self.filename
+
+
+class ReplayLog():
+    def __init__(self, filename):
+        """opens a log written by ReplayRecorder, with the frames written
+        before it was closed. If the simulation crashed, the frames whose
+        data is not completely in the log are left out, which keeps at least
+        the frames up to the last keyframe
+        """
+        self.log = open(filename, "rb")
+        if self.log.read(len(MAGIC)) != MAGIC:
+            print("Error!", filename, "is not a replay log")
+            quit()
+        length = struct.unpack("<I", self.log.read(4))[0]
+        description = json.loads(self.log.read(length).decode())
+        self.shape = tuple(description["shape"])
+        self.num_players = description["num_players"]
+        self.num_cells = int(np.prod(self.shape))
+
+        with open(filename + ".index", "rb") as f:
+            index = f.read()
+        self.index = np.frombuffer(
+            index[:len(index) - len(index) % INDEX_DTYPE.itemsize],
+            dtype=INDEX_DTYPE)
+        # drop the frames from the first one which ends past the log
+        size = self.log.seek(0, os.SEEK_END)
+        torn = np.flatnonzero(
+            self.index["offset"] + self.index["length"] > size)
+        if len(torn):
+            self.index = self.index[:torn[0]]
+        self.iterations = self.index["iteration"]
+        self.keyframes = np.flatnonzero(self.index["keyframe"])
+
+        # the last frame read, from which the next ones are rebuilt
+        self.frame = None
+        self.strategies = None
+        self.players = None
+
+    def __len__(self):
+        return len(self.index)
+
+    def read_payload(self, frame):
+        offset, length = self.index[frame][["offset", "length"]]
+        self.log.seek(int(offset))
+        return zlib.decompress(self.log.read(int(length)))
+
+    def seek(self, frame):
+        """returns the strategy values and player indices of all cells (as
+        arrays of the shape of the board, -1 in empty cells) in a frame:
+        frame 0 is the initial state and frame k the state after round k
+        """
+        if frame < 0 or frame >= len(self):
+            print("Error! The log has no frame", frame)
+            quit()
+
+        # start from the last frame read, unless a keyframe is closer
+        keyframe = self.keyframes[np.searchsorted(self.keyframes, frame,
+                                                  side="right") - 1]
+        start = keyframe
+        if self.frame is not None and keyframe <= self.frame <= frame:
+            start = self.frame + 1
+        else:
+            payload = np.frombuffer(self.read_payload(keyframe),
+                                    dtype=np.uint8)
+            self.strategies = payload[:self.num_cells].view(np.int8).copy()
+            self.players = payload[self.num_cells:].view(np.int32).copy()
+            start = keyframe + 1
+
+        for delta in range(start, frame + 1):
+            payload = np.frombuffer(self.read_payload(delta), dtype=np.uint8)
+            num_changes = len(payload) // 9
+            cells = payload[:4 * num_changes].view(np.int32)
+            self.strategies[cells] = \
+                payload[4 * num_changes:5 * num_changes].view(np.int8)
+            self.players[cells] = payload[5 * num_changes:].view(np.int32)
+        self.frame = frame
+
+        return (self.strategies.reshape(self.shape).copy(),
+                self.players.reshape(self.shape).copy())
+
+    def frames(self, start=0, stop=None, step=1):
+        """ yields the frame number and the state of a range of frames """
+        for frame in range(start, len(self) if stop is None else stop, step):
+            yield (frame,) + self.seek(frame)
+
+    def play(self, board, start=0, stop=None, step=1):
+        """draws a range of frames on a board of the same kind and size as
+        that of the simulation (e.g. a RectangularGrid or a Network built
+        with the same seed)
+        """
+        for frame, strategies, players in self.frames(start, stop, step):
+            board.draw(strategies)
+
+    def close(self):
+        self.log.close()
+
+
+if __name__ == "__main__":
+    """ Adjust replay parameters here """
+    from Board import RectangularGrid
+    from GridRenderer import GridRenderer
+
+    filename = "replay.log"
+    start = 0  # the first frame shown
+    step = 1  # the number of frames between the frames shown
+
+    log = ReplayLog(filename)
+    if len(log.shape) != 2:
+        quit("Networks are replayed with log.play(board) on a Network built "
+             "like the original one")
+    board = RectangularGrid(*log.shape, renderer=GridRenderer())
+    log.play(board, start, step=step)
+    board.quit_animation()
+    log.close()
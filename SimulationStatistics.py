@@ -1,10 +1,27 @@
+import os
 import abc
+import glob
 import time
+import queue
+import threading
+import collections
+import numpy as np
 import matplotlib.pyplot as plt
 from Game import Strategy
+from GridAnalysis import (
+    label_clusters,
+    cluster_sizes,
+    distance_bins,
+    pair_correlation,
+    segregation_index,
+)
 
 
 class SimulationStatistics(abc.ABC):
+    # why and in which iteration the simulation stopped
+    stop_reason = None
+    stop_iteration = None
+
     @abc.abstractmethod
     def record_stats(self, world, iteration):
         pass
@@ -13,15 +30,197 @@ class SimulationStatistics(abc.ABC):
     def end_simulation(self, world, iteration):
         return False
 
+    # override if desired, to record the metrics of a RoundProfiler given
+    # to simulate
+    def record_metrics(self, metrics, iteration):
+        pass
+
+    def record_stop(self, reason, iteration):
+        """ records why and when the simulation stopped """
+        self.stop_reason = reason
+        self.stop_iteration = iteration
+
+    # override to allow checkpoints of simulations with these statistics
+    def get_state(self):
+        """returns the statistics recorded so far as a flat dictionary of
+        numbers, strings, None and numpy arrays (see set_state)
+        """
+        print("Error!", type(self).__name__, "does not support checkpoints")
+        quit()
+
+    def set_state(self, state):
+        """ restores statistics returned by get_state """
+        print("Error!", type(self).__name__, "does not support checkpoints")
+        quit()
+
     @abc.abstractmethod
     def print_results(self):
         pass
 
 
-class StrategyFractionsTimeSeries(SimulationStatistics):
+class StatisticsGroup(SimulationStatistics):
+    def __init__(self, *stats):
+        """records several statistics in the same simulation, which ends as
+        soon as one of them ends it
+        """
+        self.stats = list(stats)
+
+    def record_stats(self, world, iteration):
+        for stats in self.stats:
+            stats.record_stats(world, iteration)
+
+    def record_metrics(self, metrics, iteration):
+        for stats in self.stats:
+            stats.record_metrics(metrics, iteration)
+
+    def end_simulation(self, world, iteration):
+        for stats in self.stats:
+            if stats.end_simulation(world, iteration):
+                self.record_stop(stats.stop_reason, stats.stop_iteration)
+                return True
+        return False
+
+    def record_stop(self, reason, iteration):
+        super().record_stop(reason, iteration)
+        for stats in self.stats:
+            if stats.stop_reason is None:
+                stats.record_stop(reason, iteration)
+
+    def print_results(self):
+        return [stats.print_results() for stats in self.stats]
+
+
+class RoundMetrics(SimulationStatistics):
     def __init__(self):
+        """records the metrics of every round measured by a RoundProfiler
+        given to simulate (the time and calls of each phase of the update and
+        counts of the operations)
+        """
+        self.iterations = []
+        self.metrics_ts = collections.defaultdict(list)
+
+    def record_stats(self, world, iteration):
+        pass
+
+    def record_metrics(self, metrics, iteration):
+        self.iterations.append(iteration)
+        for name, value in metrics.items():
+            self.metrics_ts[name].append(value)
+
+    def print_results(self):
+        """prints the total of each metric over all rounds and returns the
+        metrics of every round
+        """
+        for name, values in sorted(self.metrics_ts.items()):
+            print("%-30s %12.6g" % (name, sum(values)))
+        return dict(self.metrics_ts, iteration=self.iterations)
+
+
+"""
+Criteria which end a simulation once the fraction of cooperators no longer
+changes, given to the statistics recording that fraction
+"""
+
+
+class StoppingCriterion(abc.ABC):
+    @abc.abstractmethod
+    def check(self, cooperator_fraction, iteration):
+        """takes the fraction of cooperators after an iteration and returns
+        why the simulation should stop, or None if it should go on
+        """
+        pass
+
+    def get_state(self):
+        """returns what the criterion remembers of the previous iterations,
+        as a flat dictionary (see SimulationStatistics.get_state)
+        """
+        return {}
+
+    def set_state(self, state):
+        pass
+
+
+class AbsorbingState(StoppingCriterion):
+    def __init__(self, min_duration=1):
+        """stops when all players have cooperated or all players have
+        defected for min_duration iterations in a row. Without noise the
+        players can never leave these states, with noise a longer duration
+        makes sure they do not just pass through them
+        """
+        self.min_duration = min_duration
+        self.state = None
+        self.duration = 0
+
+    def check(self, cooperator_fraction, iteration):
+        state = None
+        if cooperator_fraction == 1:
+            state = "all players cooperate"
+        elif cooperator_fraction == 0:
+            state = "all players defect"
+
+        if state is not None and state == self.state:
+            self.duration += 1
+        else:
+            self.duration = 1
+        self.state = state
+
+        if state is not None and self.duration >= self.min_duration:
+            return state
+        return None
+
+    def get_state(self):
+        return {"state": self.state, "duration": self.duration}
+
+    def set_state(self, state):
+        self.state = state["state"]
+        self.duration = state["duration"]
+
+
+class RollingStationarity(StoppingCriterion):
+    def __init__(self, window=100, max_mean_change=0.005, max_std=0.02):
+        """stops when the fraction of cooperators is stationary: its mean
+        over the last window iterations differs by at most max_mean_change
+        from its mean over the window before, and its standard deviation
+        over the last window is at most max_std
+        """
+        self.window = window
+        self.max_mean_change = max_mean_change
+        self.max_std = max_std
+        self.history = collections.deque(maxlen=2 * window)
+
+    def check(self, cooperator_fraction, iteration):
+        self.history.append(cooperator_fraction)
+        if len(self.history) < 2 * self.window:
+            return None
+
+        history = np.array(self.history)
+        previous = history[:self.window]
+        last = history[self.window:]
+        if (abs(last.mean() - previous.mean()) <= self.max_mean_change and
+                last.std() <= self.max_std):
+            return "stationary cooperator fraction"
+        return None
+
+    def get_state(self):
+        return {"history": np.array(self.history, dtype=np.float64)}
+
+    def set_state(self, state):
+        self.history.clear()
+        self.history.extend(state["history"].tolist())
+
+
+class StrategyFractionsTimeSeries(SimulationStatistics):
+    def __init__(self, stopping_criteria=(), max_iteration=500):
+        """
+        - stopping_criteria: criteria which end the simulation early when
+          the fraction of cooperators has converged
+        - max_iteration: the iteration after which the simulation ends
+        """
         self.cooperator_fraction_ts = []
         self.defector_fraction_ts = []
+        self.cooperator_fraction = None
+        self.stopping_criteria = list(stopping_criteria)
+        self.max_iteration = max_iteration
 
     def record_stats(self, world, iteration):
         cooperator_fraction = world.get_num_players_with_strategy(
@@ -29,15 +228,48 @@ class StrategyFractionsTimeSeries(SimulationStatistics):
         defector_fraction = world.get_num_players_with_strategy(
             Strategy.defect)
 
-        self.cooperator_fraction_ts.append(
-            cooperator_fraction / world.num_players)
+        self.cooperator_fraction = cooperator_fraction / world.num_players
+        self.cooperator_fraction_ts.append(self.cooperator_fraction)
         self.defector_fraction_ts.append(defector_fraction / world.num_players)
 
     def end_simulation(self, world, iteration):
-        if iteration > 500:
+        if iteration > self.max_iteration:
+            self.record_stop("max_iteration of the statistics", iteration)
             return True
-        else:
-            return False
+
+        for criterion in self.stopping_criteria:
+            reason = criterion.check(self.cooperator_fraction, iteration)
+            if reason is not None:
+                self.record_stop(reason, iteration)
+                return True
+        return False
+
+    def get_state(self):
+        state = {
+            "cooperator_fraction_ts": np.array(self.cooperator_fraction_ts,
+                                               dtype=np.float64),
+            "defector_fraction_ts": np.array(self.defector_fraction_ts,
+                                             dtype=np.float64),
+            "cooperator_fraction": self.cooperator_fraction,
+            "stop_reason": self.stop_reason,
+            "stop_iteration": self.stop_iteration,
+        }
+        for i, criterion in enumerate(self.stopping_criteria):
+            for name, value in criterion.get_state().items():
+                state["criterion%d/%s" % (i, name)] = value
+        return state
+
+    def set_state(self, state):
+        self.cooperator_fraction_ts = state["cooperator_fraction_ts"].tolist()
+        self.defector_fraction_ts = state["defector_fraction_ts"].tolist()
+        self.cooperator_fraction = state["cooperator_fraction"]
+        self.stop_reason = state["stop_reason"]
+        self.stop_iteration = state["stop_iteration"]
+        for i, criterion in enumerate(self.stopping_criteria):
+            prefix = "criterion%d/" % i
+            criterion.set_state({name[len(prefix):]: value
+                                 for name, value in state.items()
+                                 if name.startswith(prefix)})
 
     def print_results(self):
         self.figure = plt.figure("Strategy Fractions Time Series")
@@ -63,3 +295,254 @@ class StrategyFractionsTimeSeries(SimulationStatistics):
 class StrategyFractionsTimeSeries4Network(StrategyFractionsTimeSeries):
     def print_results(self):
         return self.cooperator_fraction_ts
+
+
+class ClusterStatistics(SimulationStatistics):
+    def __init__(self, strategies=(Strategy.cooperate,), every=1):
+        """records the clusters of players using the same strategy (connected
+        through their play neighborhoods, see label_clusters) in worlds on a
+        rectangular grid
+        - strategies: the strategies whose clusters are recorded
+        - every: clusters are only recorded every that many iterations
+        For every recorded iteration and strategy, the size of the largest
+        cluster, the number of clusters and the size histogram (the number
+        of clusters of each size, indexed by the size) are kept.
+        """
+        self.strategies = list(strategies)
+        self.every = every
+        self.iterations = []
+        self.largest_cluster_ts = {strategy: [] for strategy in strategies}
+        self.num_clusters_ts = {strategy: [] for strategy in strategies}
+        self.size_histograms = {strategy: [] for strategy in strategies}
+
+    def record_stats(self, world, iteration):
+        if iteration % self.every != 0:
+            return
+
+        grid = world.get_strategy_grid()
+        labels = label_clusters(grid)
+        self.iterations.append(iteration)
+        for strategy in self.strategies:
+            sizes = cluster_sizes(grid, labels, strategy)
+            self.largest_cluster_ts[strategy].append(
+                int(sizes.max()) if len(sizes) else 0)
+            self.num_clusters_ts[strategy].append(len(sizes))
+            self.size_histograms[strategy].append(np.bincount(sizes))
+
+    def print_results(self):
+        return {
+            "iteration": self.iterations,
+            "largest_cluster": self.largest_cluster_ts,
+            "num_clusters": self.num_clusters_ts,
+            "size_histogram": self.size_histograms,
+        }
+
+
+class SpatialCorrelationStatistics(SimulationStatistics):
+    def __init__(self, every=10, pairs=((Strategy.cooperate,
+                                        Strategy.cooperate),
+                                       (Strategy.cooperate, Strategy.defect),
+                                       (Strategy.defect, Strategy.defect))):
+        """records the spatial structure of worlds on a rectangular grid
+        every that many iterations:
+        - the pair correlation function of each pair of strategies in pairs,
+          as an array indexed by the distance (see pair_correlation)
+        - the segregation index of the strategies (see segregation_index)
+        """
+        self.every = every
+        self.pairs = list(pairs)
+        self.bins = None
+        self.iterations = []
+        self.correlation_ts = {pair: [] for pair in self.pairs}
+        self.segregation_index_ts = []
+
+    def record_stats(self, world, iteration):
+        if iteration % self.every != 0:
+            return
+
+        grid = world.get_strategy_grid()
+        if self.bins is None or self.bins.shape != grid.shape:
+            self.bins = distance_bins(*grid.shape)
+        self.iterations.append(iteration)
+        for pair in self.pairs:
+            self.correlation_ts[pair].append(
+                pair_correlation(grid, pair[0], pair[1], self.bins))
+        self.segregation_index_ts.append(segregation_index(grid))
+
+    def print_results(self):
+        return {
+            "iteration": self.iterations,
+            "correlation": self.correlation_ts,
+            "segregation_index": self.segregation_index_ts,
+        }
+
+
+"""
+Statistics for long or headless runs, which stream their records to disk in
+columns instead of keeping them in memory. Each column is written as a
+sequence of .npy chunk files (e.g. cooperator_fraction.000000.npy) in a
+directory, by a background thread so that the simulation does not wait for
+the disk; load_columns reads them back.
+"""
+
+
+def load_columns(directory):
+    """ reads the columns written to a directory by a ChunkWriter """
+    chunks = collections.defaultdict(list)
+    for filename in sorted(glob.glob(os.path.join(directory, "*.*.npy"))):
+        column = os.path.basename(filename).split(".")[0]
+        chunks[column].append(np.load(filename))
+
+    return {column: np.concatenate(arrays)
+            for column, arrays in chunks.items()}
+
+
+class ChunkWriter():
+    def __init__(self, directory, columns, chunk_size=4096, max_pending=4):
+        """
+        - directory: where the chunk files are written (created if needed,
+          chunks from an earlier run are removed)
+        - columns: a list of (name, dtype) of the columns
+        - chunk_size: the number of records buffered before a chunk is
+          handed to the writer thread
+        - max_pending: the number of chunks waiting to be written after which
+          appending waits for the writer, bounding the memory used
+        Chunks from an earlier run are removed before the first chunk is
+        written, except those before num_chunks when it is set to continue
+        an earlier run.
+        """
+        os.makedirs(directory, exist_ok=True)
+
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.buffers = {name: np.empty(chunk_size, dtype=dtype)
+                        for name, dtype in columns}
+        self.num_buffered = 0
+        self.num_chunks = 0
+        self.stale_chunks_removed = False
+        self.error = None
+        self.pending = queue.Queue(max_pending)
+        self.thread = threading.Thread(target=self.write_chunks, daemon=True)
+        self.thread.start()
+
+    def append(self, **record):
+        """ adds a record, given as the values of the columns """
+        for name, value in record.items():
+            self.buffers[name][self.num_buffered] = value
+        self.num_buffered += 1
+        if self.num_buffered == self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        """ hands the buffered records to the writer thread """
+        self.remove_stale_chunks()
+        if self.num_buffered == 0:
+            return
+        chunk = {name: buffer[:self.num_buffered].copy()
+                 for name, buffer in self.buffers.items()}
+        self.pending.put((self.num_chunks, chunk))
+        self.num_chunks += 1
+        self.num_buffered = 0
+
+    def remove_stale_chunks(self):
+        """ removes the chunks of an earlier run which are not continued """
+        if self.stale_chunks_removed:
+            return
+        for filename in glob.glob(os.path.join(self.directory, "*.*.npy")):
+            if int(os.path.basename(filename).split(".")[1]) >= \
+                    self.num_chunks:
+                os.remove(filename)
+        self.stale_chunks_removed = True
+
+    def write_chunks(self):
+        while True:
+            item = self.pending.get()
+            if item is None:
+                self.pending.task_done()
+                break
+            if self.error is None:
+                # after a failed write the chunks are dropped
+                number, chunk = item
+                try:
+                    for name, values in chunk.items():
+                        np.save(os.path.join(self.directory, "%s.%06d.npy"
+                                             % (name, number)), values)
+                except OSError as error:
+                    self.error = error
+            self.pending.task_done()
+
+    def sync(self):
+        """writes the buffered records and waits until all chunks are on
+        disk
+        """
+        self.flush()
+        self.pending.join()
+        self.check_error()
+
+    def check_error(self):
+        if self.error is not None:
+            print("Error! Could not write the statistics to", self.directory,
+                  "-", self.error)
+            quit()
+
+    def close(self):
+        """writes the remaining records and waits until all chunks are on
+        disk
+        """
+        if self.thread is None:
+            return
+        self.flush()
+        self.pending.put(None)
+        self.thread.join()
+        self.thread = None
+        self.check_error()
+
+
+class StreamingStrategyFractions(StrategyFractionsTimeSeries):
+    def __init__(self, directory, stopping_criteria=(), max_iteration=500,
+                 every=1, chunk_size=4096):
+        """records the same time series as StrategyFractionsTimeSeries, but
+        streams them to the columns iteration, cooperator_fraction and
+        defector_fraction in a directory (see ChunkWriter), using a bounded
+        amount of memory however long the run
+        - every: only every that many iterations are recorded, to thin out
+          very long runs (the stopping criteria still see every iteration)
+        """
+        super().__init__(stopping_criteria, max_iteration)
+        self.directory = directory
+        self.every = every
+        self.writer = ChunkWriter(directory, [
+            ("iteration", np.int64),
+            ("cooperator_fraction", np.float64),
+            ("defector_fraction", np.float64),
+        ], chunk_size)
+
+    def record_stats(self, world, iteration):
+        self.cooperator_fraction = world.get_num_players_with_strategy(
+            Strategy.cooperate) / world.num_players
+        if iteration % self.every != 0:
+            return
+
+        self.writer.append(
+            iteration=iteration,
+            cooperator_fraction=self.cooperator_fraction,
+            defector_fraction=world.get_num_players_with_strategy(
+                Strategy.defect) / world.num_players)
+
+    def get_state(self):
+        # the records are on disk, up to the last chunk
+        self.writer.sync()
+        state = super().get_state()
+        state["num_chunks"] = self.writer.num_chunks
+        return state
+
+    def set_state(self, state):
+        super().set_state(state)
+        self.writer.num_chunks = state["num_chunks"]
+
+    def print_results(self):
+        """writes the remaining records and returns the directory, without
+        plotting or waiting for the user
+        """
+        self.writer.close()
+        return self.directory
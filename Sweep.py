@@ -0,0 +1,111 @@
+import csv
+import random
+import itertools
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+
+"""
+Runs a simulation for every combination of parameter values in a grid, a
+number of times each (replicates), spread over several processes.
+
+The simulation is a function run(**params) defined at the top level of a
+module (so that it can be sent to the worker processes), which builds and
+simulates a world and returns its final statistics as a dictionary (or a
+single number). Before each run the random number generators are seeded
+with a seed derived from the sweep seed, the index of the parameter
+combination and the replicate, so that the results do not depend on the
+number of workers or the order in which the runs finish.
+"""
+
+
+def task_seed(seed, params_index, replicate):
+    """ gets the seed of one run of a sweep """
+    return int(np.random.SeedSequence(
+        [seed, params_index, replicate]).generate_state(1)[0])
+
+
+def run_task(run, params, seed):
+    """ seeds the random number generators and performs one run """
+    random.seed(seed)
+    np.random.seed(seed)
+    return run(**params)
+
+
+def parameter_combinations(grid):
+    """gets all combinations of the parameter values in a grid, a dictionary
+    of parameter names and lists of values, as dictionaries
+    """
+    names = list(grid)
+    return [dict(zip(names, values))
+            for values in itertools.product(*[grid[name] for name in names])]
+
+
+def sweep(run, grid, num_replicates=1, seed=0, max_workers=None,
+          max_retries=3):
+    """performs num_replicates runs of run(**params) for every combination of
+    parameter values in grid and returns a table of the results: a list of
+    rows (dictionaries) with the parameters, the replicate, the seed and the
+    statistics returned by the run (under "result" if it is a number), in the
+    order of the parameter combinations and replicates.
+
+    If a worker process dies (e.g. it is killed or runs out of memory), the
+    runs which did not finish are started again in a new pool of workers, at
+    most max_retries times
+    """
+    tasks = {}
+    for params_index, params in enumerate(parameter_combinations(grid)):
+        for replicate in range(num_replicates):
+            tasks[(params_index, replicate)] = (
+                params, task_seed(seed, params_index, replicate))
+
+    results = {}
+    num_attempts = 0
+    while len(results) < len(tasks):
+        if num_attempts > max_retries:
+            print("Error! Workers of the sweep crashed", num_attempts,
+                  "times,", len(tasks) - len(results), "runs did not finish")
+            quit()
+        num_attempts += 1
+
+        with ProcessPoolExecutor(max_workers) as executor:
+            futures = {}
+            for task, (params, run_seed) in tasks.items():
+                if task not in results:
+                    futures[executor.submit(
+                        run_task, run, params, run_seed)] = task
+            try:
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+            except BrokenProcessPool:
+                # collect the runs which finished before the crash
+                for future, task in futures.items():
+                    if (future.done() and not future.cancelled() and
+                            future.exception() == None):
+                        results[task] = future.result()
+
+    rows = []
+    for task in sorted(tasks):
+        params, run_seed = tasks[task]
+        row = dict(params, replicate=task[1], seed=run_seed)
+        if isinstance(results[task], dict):
+            row.update(results[task])
+        else:
+            row["result"] = results[task]
+        rows.append(row)
+
+    return rows
+
+
+def save_table(rows, filename):
+    """ writes the table of results of a sweep to a csv file """
+    columns = []
+    for row in rows:
+        for column in row:
+            if column not in columns:
+                columns.append(column)
+
+    with open(filename, "w", newline="") as f:
+        writer = csv.DictWriter(f, columns)
+        writer.writeheader()
+        writer.writerows(rows)
@@ -0,0 +1,704 @@
+import numpy as np
+from Game import Strategy, make_rng
+from Board import RectangularGrid, get_wrapped_ranges
+
+"""
+An array-backed world for the prisoners dilemma on a rectangular grid. The
+strategies of all players are held in one NumPy array (EMPTY for unoccupied
+cells), so that payoffs can be computed for every cell at once with shifted
+copies of the grid instead of visiting the players one by one.
+
+Two update modes are offered:
+- "sequential": players are updated one at a time in random order, with the
+  same rules as World.round. The grid is copied to Python lists for the
+  round, in which neighbor counts and payoffs are kept up to date
+  incrementally.
+- "synchronous": every player plays, migrates and imitates based on the same
+  snapshot of the grid, which can be computed for the whole grid in a few
+  vectorized passes. This changes the dynamics (see synchronous_round).
+
+Both modes reproduce a detail of World.migration_update which noticeably
+affects the results: a player imitating after migration compares the
+payoff it recorded in the last empty cell it tried (in row by row order of
+its migration neighborhood), not the payoff in the cell it moved to. Unlike
+World, distances between cells account for the periodic boundaries.
+"""
+
+# value of a cell in the strategy array when it is not occupied by a player
+EMPTY = -1
+
+# streams of the counter based random numbers used in synchronous rounds
+STREAM_NOISE = 1
+STREAM_NOISE1 = 2
+STREAM_PRIORITY = 3
+STREAM_NOISE2 = 4
+STREAM_TIE = 16
+
+# the play neighborhood (above, below, left, right) as row/column shifts
+PLAY_NEIGHBORHOOD = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+
+def counter_uniform(key, stream, index):
+    """returns uniform random numbers in [0, 1) which only depend on the key,
+    the stream and the global index of each cell, so that they do not depend
+    on the order (or the process) in which the cells are visited
+    """
+    seed = (key + stream * 0xD1B54A32D192ED03) % 2 ** 64
+    with np.errstate(over="ignore"):
+        z = np.asarray(index).astype(np.uint64) * \
+            np.uint64(0x9E3779B97F4A7C15)
+        z += np.uint64(seed)
+        z ^= z >> np.uint64(30)
+        z *= np.uint64(0xBF58476D1CE4E5B9)
+        z ^= z >> np.uint64(27)
+        z *= np.uint64(0x94D049BB133111EB)
+        z ^= z >> np.uint64(31)
+    return (z >> np.uint64(11)).astype(np.float64) * 2.0 ** -53
+
+
+def shifted(array, di, dj):
+    """returns an array whose value at cell (i, j) is the value of the input
+    array at cell (i + di, j + dj), with periodic boundary conditions
+    """
+    return np.roll(array, (-di, -dj), axis=(-2, -1))
+
+
+def migration_offsets(M, height, width):
+    """returns the offsets (di, dj) of the cells in the Moore neighborhood of
+    range M, sorted by distance, together with their squared distance and
+    the number of times the center cell is itself in the play neighborhood
+    of the offset cell (which matters as the migrating player leaves it) and
+    the rank of the offset when the neighborhood is scanned row by row
+    """
+    offsets = []
+    seen = set()
+    candidates = [(di, dj) for di in range(-M, M + 1)
+                  for dj in range(-M, M + 1)]
+    candidates.sort(key=lambda o: o[0] ** 2 + o[1] ** 2)
+    for di, dj in candidates:
+        cell = (di % height, dj % width)
+        # ignore the cell itself and offsets wrapping onto the same cell
+        if cell == (0, 0) or cell in seen:
+            continue
+        seen.add(cell)
+        self_links = 0
+        for ni, nj in PLAY_NEIGHBORHOOD:
+            if (di + ni) % height == 0 and (dj + nj) % width == 0:
+                self_links += 1
+        raster_rank = (di + M) * (2 * M + 1) + dj + M
+        offsets.append((di, dj, di ** 2 + dj ** 2, self_links, raster_rank))
+
+    return offsets
+
+
+def play_neighbor_table(height, width):
+    """returns the flat indices of the cells in the play neighborhood of
+    every cell of a grid, as a list of tuples indexed by flat cell index
+    """
+    index = np.arange(height * width).reshape(height, width)
+    neighbors = [shifted(index, di, dj).reshape(-1).tolist()
+                 for di, dj in PLAY_NEIGHBORHOOD]
+    return list(zip(*neighbors))
+
+
+def neighbor_counts(strategies):
+    """counts, for every cell, the players of each strategy in its play
+    neighborhood
+    """
+    counts = np.zeros((len(Strategy),) + strategies.shape, dtype=np.int8)
+    for strategy in Strategy:
+        players = (strategies == strategy.value).astype(np.int8)
+        for di, dj in PLAY_NEIGHBORHOOD:
+            counts[strategy.value] += shifted(players, di, dj)
+
+    return counts
+
+
+def count_strategies(strategies):
+    """returns the number of players using each strategy (by value) on a
+    grid of strategies, as a list
+    """
+    return np.bincount(strategies[strategies != EMPTY],
+                       minlength=len(Strategy)).tolist()
+
+
+def payoff_if_here(counts, matrix, strategy):
+    """returns the payoff a player with the given strategy value would
+    receive in every cell given the neighbor counts. The entries of the
+    payoff matrix are either numbers or, for games in which the payoffs
+    depend on the players, arrays with the entry of the player of each cell
+    """
+    payoff = matrix[strategy, 0] * counts[0]
+    for s in range(1, len(counts)):
+        payoff = payoff + matrix[strategy, s] * counts[s]
+    return payoff
+
+
+def payoff_field(strategies, counts, matrix):
+    """returns the payoff of the player in every cell (0 for empty cells)"""
+    payoffs = np.zeros(strategies.shape)
+    for strategy in Strategy:
+        here = strategies == strategy.value
+        payoffs[here] = payoff_if_here(counts, matrix, strategy.value)[here]
+
+    return payoffs
+
+
+def migration_moves(strategies, counts, matrix, offsets, index, key):
+    """determines for every player the offset (into offsets) of the empty
+    cell it migrates to, or -1 if it stays. A player moves to the cell with
+    the highest payoff in its migration neighborhood; ties are broken in
+    favour of its current cell, then of the closest cells, and uniformly at
+    random between cells at the same distance. Also returns the payoff each
+    player records while trying the cells (see the module description)
+    """
+    occupied = strategies != EMPTY
+    empty = ~occupied
+    mine = [strategies == s.value for s in Strategy]
+
+    # with a single payoff matrix, the payoffs in each cell can be computed
+    # once and shifted, otherwise the row of the payoff matrix of the
+    # migrating player is used with the neighbor counts shifted from the
+    # cells it would migrate to
+    single_matrix = np.ndim(matrix) == 2
+    if single_matrix:
+        here = [payoff_if_here(counts, matrix, s.value) for s in Strategy]
+    else:
+        own_matrix = np.array(matrix[:1], dtype=float)
+        np.copyto(own_matrix[0], matrix[1], where=mine[1])
+
+    best_payoff = payoff_field(strategies, counts, matrix)
+    best_move = np.full(strategies.shape, -1, dtype=np.int16)
+    best_distance = np.zeros(strategies.shape, dtype=np.int32)
+    num_ties = np.ones(strategies.shape, dtype=np.int32)
+    recorded_payoff = best_payoff.copy()
+    recorded_rank = np.full(strategies.shape, -1, dtype=np.int32)
+
+    for k, (di, dj, distance, self_links, raster_rank) in enumerate(offsets):
+        candidate = occupied & shifted(empty, di, dj)
+        if not candidate.any():
+            continue
+
+        if self_links:
+            # the migrating player does not play with itself
+            counts_there = shifted(counts, di, dj).astype(np.int32)
+            payoff = np.zeros(strategies.shape)
+            for s in range(len(Strategy)):
+                own_counts = counts_there.copy()
+                own_counts[s] -= self_links
+                np.copyto(payoff, payoff_if_here(own_counts, matrix, s),
+                          where=mine[s])
+        elif single_matrix:
+            payoff = np.zeros(strategies.shape)
+            for s in range(len(Strategy)):
+                np.copyto(payoff, shifted(here[s], di, dj), where=mine[s])
+        else:
+            payoff = payoff_if_here(shifted(counts, di, dj), own_matrix, 0)
+
+        better = candidate & (payoff > best_payoff)
+        tie = candidate & (payoff == best_payoff)
+        if tie.any():
+            tie &= (best_move >= 0) & (best_distance == distance)
+            num_ties[tie] += 1
+            # reservoir sampling between equally good cells at the same
+            # distance
+            tie[tie] = counter_uniform(key, STREAM_TIE + k, index[tie]) * \
+                num_ties[tie] < 1
+            better |= tie
+        num_ties[better & ~tie] = 1
+        np.copyto(best_payoff, payoff, where=better)
+        best_move[better] = k
+        best_distance[better] = distance
+
+        last = candidate & (recorded_rank < raster_rank)
+        np.copyto(recorded_payoff, payoff, where=last)
+        recorded_rank[last] = raster_rank
+
+    return best_move, recorded_payoff
+
+
+def resolve_migration(moves, offsets, index, key):
+    """determines for every empty cell the offset (into offsets) of the
+    player which migrates into it, or -1 if none does. If several players
+    want to move to the same cell, the one with the smallest random priority
+    wins and the others stay where they are
+    """
+    priority = counter_uniform(key, STREAM_PRIORITY, index)
+    winner = np.full(moves.shape, -1, dtype=np.int16)
+    winner_priority = np.full(moves.shape, np.inf)
+
+    for k, (di, dj, distance, self_links, raster_rank) in enumerate(offsets):
+        claim = shifted(moves == k, -di, -dj)
+        if not claim.any():
+            continue
+        claim_priority = shifted(priority, -di, -dj)
+        wins = claim & (claim_priority < winner_priority)
+        winner[wins] = k
+        winner_priority[wins] = claim_priority[wins]
+
+    return winner
+
+
+def apply_migration(arrays, moves, winners, offsets, empty_value):
+    """moves the contents of each array (strategies first) according to the
+    resolved migration moves and returns the new arrays
+    """
+    moved = [array.copy() for array in arrays]
+    for k, (di, dj, distance, self_links, raster_rank) in enumerate(offsets):
+        arrived = winners == k
+        if not arrived.any():
+            continue
+        left = (moves == k) & shifted(arrived, di, dj)
+        for array, new, value in zip(arrays, moved, empty_value):
+            new[arrived] = shifted(array, -di, -dj)[arrived]
+            new[left] = value
+
+    return moved
+
+
+def imitation_strategies(strategies, payoffs, own_payoffs):
+    """returns for every cell the strategy of the most successful player
+    among itself and its play neighborhood (the first one in the order
+    above, below, left, right on ties with a neighbor). Players compare the
+    payoffs of their neighbors with their own recorded payoff
+    """
+    best_payoff = own_payoffs.copy()
+    best_strategy = strategies.copy()
+    for di, dj in PLAY_NEIGHBORHOOD:
+        neighbor_strategy = shifted(strategies, di, dj)
+        neighbor_payoff = shifted(payoffs, di, dj)
+        better = (neighbor_strategy != EMPTY) & (neighbor_payoff > best_payoff)
+        best_payoff[better] = neighbor_payoff[better]
+        best_strategy[better] = neighbor_strategy[better]
+
+    return np.where(strategies != EMPTY, best_strategy, EMPTY)
+
+
+class VectorizedWorld():
+    def __init__(self, game, board, players, r=0, q=0, noise1=False,
+                 noise2=False, imitation=False, migration=False, M=0,
+                 update="sequential", seed=None):
+        """
+        takes the same arguments as World, restricted to a RectangularGrid
+        board and a game with payoff matrices (PrisonersDilemma or
+        AsymmetricPrisonersDilemma), and
+        - update: "sequential" or "synchronous", see the module description
+        - seed: a seed or numpy random number generator from which all random
+          choices of the world are drawn (see make_rng)
+        The players and the board are only brought up to date with the
+        arrays by calling sync_players, except for the index of free cells
+        of the board, from which the sequential update draws the cells of
+        Noise 2.
+        """
+        if not isinstance(board, RectangularGrid):
+            print("Error! VectorizedWorld requires a RectangularGrid board")
+            quit()
+        if game.payoff_matrix is None and \
+                not hasattr(game, "payoff_matrices"):
+            print("Error! VectorizedWorld requires a game with payoff matrices")
+            quit()
+        if update not in ("sequential", "synchronous"):
+            print("Error! Unknown update mode", update)
+            quit()
+
+        self.game = game
+        self.board = board
+        self.num_players = len(players)
+        self.players = players
+        self.r = r
+        self.q = q
+        self.noise1 = noise1
+        self.noise2 = noise2
+        self.imitation = imitation
+        self.migration = migration
+        self.M = M
+        self.update = update
+        self.rng = make_rng(seed)
+
+        self.height = board.height
+        self.width = board.width
+        self.num_cells = self.height * self.width
+        self.offsets = migration_offsets(M, self.height, self.width)
+        self.index = np.arange(self.num_cells).reshape(
+            self.height, self.width)
+
+        # randomly insert players in board cells
+        if len(players) > self.num_cells:
+            print("Error! Number of players exceeds the number of cells")
+            quit()
+
+        cells = self.rng.permutation(self.num_cells)[:len(players)]
+        self.strategies = np.full(self.num_cells, EMPTY, dtype=np.int8)
+        self.strategies[cells] = [player.strategy.value for player in players]
+        self.strategies = self.strategies.reshape(self.height, self.width)
+        # index of the player (in self.players) occupying each cell
+        self.player_ids = np.full(self.num_cells, -1, dtype=np.int32)
+        self.player_ids[cells] = np.arange(len(players))
+        self.player_ids = self.player_ids.reshape(self.height, self.width)
+        # number of players using each strategy, kept up to date by the
+        # updates
+        self.strategy_counts = count_strategies(self.strategies)
+
+        # one payoff matrix for all players, or one per player in games in
+        # which the payoffs depend on the players, computed all at once
+        self.matrix = None
+        self.player_matrices = None
+        if game.payoff_matrix is not None:
+            self.matrix = np.array(game.payoff_matrix, dtype=np.float64)
+        else:
+            self.player_matrices = game.payoff_matrices(
+                [player.multipliers for player in self.players])
+
+        self.counts = neighbor_counts(self.strategies)
+
+        if update == "sequential":
+            self.init_sequential_tables()
+
+    def init_sequential_tables(self):
+        """sets up the tables of the sequential update, which visits the
+        cells one at a time by flat index: the play neighborhood of every
+        cell, the first flat index of the rows and the columns from x - M
+        to x + M around every row and column x, the offsets of the migration
+        neighborhood as positions in these ranges and the rows of the payoff
+        matrix of every player (by player index)
+        """
+        self.play_neighbors = play_neighbor_table(self.height, self.width)
+        self.migration_rows = [
+            [row * self.width for row in rows]
+            for rows in get_wrapped_ranges(self.height, self.M)]
+        self.migration_columns = get_wrapped_ranges(self.width, self.M)
+        self.migration_table = [
+            (di + self.M, dj + self.M, distance, self_links, raster_rank)
+            for di, dj, distance, self_links, raster_rank in self.offsets]
+        if self.player_matrices is None:
+            # all players share the matrix of the game
+            self.matrix_rows = [self.matrix.tolist()] * self.num_players
+        else:
+            self.matrix_rows = self.player_matrices.tolist()
+
+        # the lists of the cells, only set during a round (see _load_cells)
+        self.cell_strategies = None
+        self.cell_player_ids = None
+        self.cell_counts = None
+        self.cell_payoffs = None
+
+    def round(self):
+        """carries out one round of updates according to the update mode"""
+        if self.update == "sequential":
+            self.sequential_round()
+        else:
+            self.synchronous_round()
+
+    def sequential_round(self):
+        """carries out one round in which each player is updated once, in
+        random order, with the same rules as World.round (see the module
+        description for the difference). The cells are visited one at a
+        time, so the arrays are copied to Python lists for the round, which
+        are much faster to index than NumPy arrays, and the payoff of every
+        cell is kept in a list updated as the players change
+        """
+        self._load_cells()
+        strategies = self.cell_strategies
+        payoffs = self.cell_payoffs
+        play_neighbors = self.play_neighbors
+        r = self.r
+        q = self.q
+        migration = self.migration and bool(self.offsets)
+        cooperate = Strategy.cooperate.value
+        defect = Strategy.defect.value
+
+        # follow the players rather than the cells when they move
+        occupied = np.flatnonzero(self.strategies.reshape(-1) != EMPTY)
+        cells = dict(zip(self.player_ids.reshape(-1)[occupied].tolist(),
+                         occupied.tolist()))
+        order = list(cells)
+        self.rng.shuffle(order)
+        # the random numbers of the round are drawn at once
+        rands = self.rng.random(len(order)).tolist()
+        noise1_rands = self.rng.random(len(order)).tolist()
+
+        for player_id, rand, noise1_rand in zip(order, rands, noise1_rands):
+            cell = cells[player_id]
+            payoff = payoffs[cell]
+
+            # perform migration step
+            if migration:
+                cell, payoff = self._sequential_migration(cell, payoff)
+                cells[player_id] = cell
+
+            if rand < r:
+                # randomly reset player strategy and/or location
+                if self.noise1:
+                    if noise1_rand < q:
+                        self._set_strategy(cell, cooperate)
+                    else:
+                        self._set_strategy(cell, defect)
+
+                if self.noise2:
+                    cell = self._sequential_noise2(cell)
+                    cells[player_id] = cell
+
+            elif self.imitation:
+                # perform imitation step (empty cells have a payoff of
+                # minus infinity)
+                strategy = best_strategy = strategies[cell]
+                for neighbor in play_neighbors[cell]:
+                    if payoffs[neighbor] > payoff:
+                        payoff = payoffs[neighbor]
+                        best_strategy = strategies[neighbor]
+                if best_strategy != strategy:
+                    self._set_strategy(cell, best_strategy)
+
+        self._store_cells()
+
+    def _load_cells(self):
+        """copies the arrays to the lists used in sequential rounds: the
+        strategies, player indices, neighbor counts (per strategy) and
+        payoffs (minus infinity if empty) of the cells
+        """
+        self.cell_strategies = self.strategies.reshape(-1).tolist()
+        self.cell_player_ids = self.player_ids.reshape(-1).tolist()
+        self.cell_counts = self.counts.reshape(len(Strategy), -1).tolist()
+        self.cell_payoffs = np.where(self.strategies != EMPTY,
+                                     self.get_payoffs(),
+                                     -np.inf).reshape(-1).tolist()
+        if self.noise2:
+            # Noise 2 draws from the index of free cells of the board, which
+            # is kept up to date with the moves of the round
+            self.board.set_free_cells(
+                np.flatnonzero(self.strategies.reshape(-1) == EMPTY).tolist())
+
+    def _store_cells(self):
+        """ copies the lists of the sequential round back to the arrays """
+        self.strategies.reshape(-1)[:] = self.cell_strategies
+        self.player_ids.reshape(-1)[:] = self.cell_player_ids
+        self.counts.reshape(len(Strategy), -1)[:] = self.cell_counts
+        self.cell_strategies = None
+        self.cell_player_ids = None
+        self.cell_counts = None
+        self.cell_payoffs = None
+
+    def _update_payoffs(self, cell):
+        """computes again the payoffs of the player in a cell and of the
+        players it plays with
+        """
+        strategies = self.cell_strategies
+        counts = self.cell_counts
+        for changed in (cell,) + self.play_neighbors[cell]:
+            strategy = strategies[changed]
+            if strategy == EMPTY:
+                self.cell_payoffs[changed] = -np.inf
+                continue
+            payoffs = \
+                self.matrix_rows[self.cell_player_ids[changed]][strategy]
+            self.cell_payoffs[changed] = (payoffs[0] * counts[0][changed] +
+                                          payoffs[1] * counts[1][changed])
+
+    def _place(self, cell, strategy, sign):
+        """adds (sign 1) or removes (sign -1) the contribution of a player
+        with a strategy in a cell to the neighbor counts
+        """
+        counts = self.cell_counts[strategy]
+        for neighbor in self.play_neighbors[cell]:
+            counts[neighbor] += sign
+
+    def _set_strategy(self, cell, strategy):
+        old_strategy = self.cell_strategies[cell]
+        if old_strategy != strategy:
+            self._place(cell, old_strategy, -1)
+            self._place(cell, strategy, 1)
+            self.cell_strategies[cell] = strategy
+            self.strategy_counts[old_strategy] -= 1
+            self.strategy_counts[strategy] += 1
+            self._update_payoffs(cell)
+
+    def _move(self, cell, new_cell):
+        strategies = self.cell_strategies
+        player_ids = self.cell_player_ids
+        strategy = strategies[cell]
+        self._place(cell, strategy, -1)
+        self._place(new_cell, strategy, 1)
+        strategies[new_cell] = strategy
+        strategies[cell] = EMPTY
+        player_ids[new_cell] = player_ids[cell]
+        player_ids[cell] = -1
+        self._update_payoffs(cell)
+        self._update_payoffs(new_cell)
+
+        if self.noise2:
+            self.board.update_free_index(new_cell, True)
+            self.board.update_free_index(cell, False)
+
+    def _sequential_migration(self, cell, payoff):
+        """moves the player in a cell to the most favorable empty cell in its
+        migration neighborhood, returns its new cell and the payoff it
+        recorded in the last empty cell it tried
+        """
+        strategies = self.cell_strategies
+        counts = self.cell_counts
+        strategy = strategies[cell]
+        payoffs = self.matrix_rows[self.cell_player_ids[cell]][strategy]
+        i, j = divmod(cell, self.width)
+        rows = self.migration_rows[i]
+        columns = self.migration_columns[j]
+
+        recorded_payoff = payoff
+        recorded_rank = -1
+        best_payoff = payoff
+        best_distance = None
+        best_cells = []
+        for row, column, distance, self_links, raster_rank in \
+                self.migration_table:
+            candidate = rows[row] + columns[column]
+            if strategies[candidate] != EMPTY:
+                continue
+
+            own_counts = [counts[0][candidate], counts[1][candidate]]
+            # the migrating player does not play with itself
+            own_counts[strategy] -= self_links
+            candidate_payoff = (payoffs[0] * own_counts[0] +
+                                payoffs[1] * own_counts[1])
+            if raster_rank > recorded_rank:
+                recorded_payoff = candidate_payoff
+                recorded_rank = raster_rank
+
+            # the cells are tried from the closest, so the best cells at the
+            # smallest distance are kept
+            if candidate_payoff > best_payoff:
+                best_payoff = candidate_payoff
+                best_distance = distance
+                best_cells = [candidate]
+            elif candidate_payoff == best_payoff and \
+                    distance == best_distance:
+                best_cells.append(candidate)
+
+        if not best_cells:
+            return cell, recorded_payoff
+
+        # migrate to a random one of the closest most favorable cells
+        new_cell = best_cells[0]
+        if len(best_cells) > 1:
+            new_cell = best_cells[int(self.rng.integers(len(best_cells)))]
+        self._move(cell, new_cell)
+        return new_cell, recorded_payoff
+
+    def _sequential_noise2(self, cell):
+        """moves the player in a cell to a uniformly random empty cell"""
+        random_cell = self.board.random_free_cell(self.rng)
+        if random_cell is None:
+            return cell
+
+        random_cell = self.board.cell_index(random_cell)
+        self._move(cell, random_cell)
+        return random_cell
+
+    def synchronous_round(self):
+        """carries out one round in which all players are updated at once:
+        1. every player picks the most favorable cell in its migration
+           neighborhood given the grid at the start of the round; when
+           several players pick the same empty cell the one with the lowest
+           random priority moves there and the others stay
+        2. every player then either resets (probability r) or imitates the
+           most successful player in its new neighborhood, with the payoffs
+           of the neighbors computed after all migrations
+        3. players resetting their location (Noise 2) move to distinct
+           random cells among those empty after step 2
+        """
+        key = int(self.rng.integers(2 ** 64, dtype=np.uint64))
+        strategies = self.strategies
+        player_ids = self.player_ids
+        recorded_payoffs = None
+
+        if self.migration and self.offsets:
+            moves, recorded_payoffs = migration_moves(
+                strategies, self.counts, self.cell_matrices(player_ids),
+                self.offsets, self.index, key)
+            winners = resolve_migration(moves, self.offsets, self.index, key)
+            strategies, player_ids, recorded_payoffs = apply_migration(
+                [strategies, player_ids, recorded_payoffs], moves, winners,
+                self.offsets, [EMPTY, -1, 0])
+
+        occupied = strategies != EMPTY
+        noisy = occupied & (counter_uniform(key, STREAM_NOISE, self.index)
+                            < self.r)
+        new_strategies = strategies
+        if self.imitation:
+            counts = neighbor_counts(strategies)
+            payoffs = payoff_field(strategies, counts,
+                                   self.cell_matrices(player_ids))
+            if recorded_payoffs is None:
+                recorded_payoffs = payoffs
+            new_strategies = np.where(noisy, strategies, imitation_strategies(
+                strategies, payoffs, recorded_payoffs))
+        if self.noise1:
+            reset = np.where(
+                counter_uniform(key, STREAM_NOISE1, self.index) < self.q,
+                Strategy.cooperate.value, Strategy.defect.value)
+            new_strategies = np.where(noisy, reset, new_strategies)
+        strategies = new_strategies.astype(np.int8)
+        self.strategy_counts = count_strategies(strategies)
+
+        if self.noise2:
+            strategies, player_ids = self._synchronous_noise2(
+                strategies, player_ids, np.flatnonzero(noisy), key)
+
+        self.strategies = strategies
+        self.player_ids = player_ids
+        self.counts = neighbor_counts(strategies)
+
+    def _synchronous_noise2(self, strategies, player_ids, movers, key):
+        """moves the given players to distinct random empty cells"""
+        generator = np.random.default_rng([key, STREAM_NOISE2])
+        empty_cells = np.flatnonzero(strategies == EMPTY)
+        movers = generator.permutation(movers)[:len(empty_cells)]
+        targets = generator.choice(empty_cells, len(movers), replace=False)
+
+        strategies = strategies.reshape(-1).copy()
+        player_ids = player_ids.reshape(-1).copy()
+        strategies[targets] = strategies[movers]
+        player_ids[targets] = player_ids[movers]
+        strategies[movers] = EMPTY
+        player_ids[movers] = -1
+        return (strategies.reshape(self.height, self.width),
+                player_ids.reshape(self.height, self.width))
+
+    def get_payoffs(self):
+        """ returns the current payoff of the player in every cell """
+        return payoff_field(self.strategies, self.counts,
+                            self.cell_matrices(self.player_ids))
+
+    def cell_matrices(self, player_ids):
+        """returns the payoff matrix to use for the player in every cell: the
+        matrix of the game, or an array (focal, opponent, row, column) with
+        the matrices of the players in the cells
+        """
+        if self.player_matrices is None:
+            return self.matrix
+        return np.moveaxis(self.player_matrices[player_ids], (-2, -1), (0, 1))
+
+    def sync_players(self):
+        """writes the strategies, cells and payoffs held in the arrays back
+        to the player objects and the board
+        """
+        payoffs = self.get_payoffs()
+        for i in range(self.height):
+            for j in range(self.width):
+                player_id = self.player_ids[i, j]
+                if player_id < 0:
+                    self.board.assign_player_to_cell(None, (i, j))
+                    continue
+                player = self.players[player_id]
+                player.strategy = Strategy(int(self.strategies[i, j]))
+                player.cell = (i, j)
+                player.payoff = float(payoffs[i, j])
+                self.board.assign_player_to_cell(player, (i, j))
+
+    def get_strategy_grid(self):
+        """returns the strategy values of the players in all cells, EMPTY in
+        empty cells
+        """
+        return self.strategies
+
+    def get_num_players_with_strategy(self, strat):
+        """ returns the number of players on the grid using a stratgy """
+        return self.strategy_counts[strat.value]
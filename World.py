@@ -1,6 +1,9 @@
-import random
-from Game import Strategy
+import math
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from Game import Strategy, make_rng
 from Board import RectangularGrid
+from Population import Population
 
 """
 The world in which the simulation takes place
@@ -9,11 +12,13 @@ The world in which the simulation takes place
 
 class World():
     def __init__(self, game, board, players, r=0, q=0, noise1=False,
-                 noise2=False, imitation=False, migration=False, M=0):
+                 noise2=False, imitation=False, migration=False, M=0,
+                 debug_payoff_cache=False, seed=None, update="sequential",
+                 num_threads=1):
         """
         - game: game played between two players during an interaction
         - board: topology of the world
-        - players: a list of players in the world
+        - players: a list of players in the world, or a Population
         - r: probability that a player randomly resets its strategy
         - q: conditional probability that a player resets to cooperate
         - noise1: a boolean indicating whether Noise 1 is present
@@ -21,7 +26,26 @@ class World():
         - imitation: a boolean indicating whether players perform imitation
         - migration: a boolean indicating whether players perform migration
         - M: the range of the Moore neighborhood around each cell
+        - debug_payoff_cache: a boolean indicating whether cached payoffs are
+          checked against a fresh computation whenever they are read
+        - seed: a seed or numpy random number generator from which all random
+          choices of the world are drawn (see make_rng)
+        - update: "sequential" to update the players one after the other in
+          random order, or "synchronous" to update all of them from the same
+          snapshot of the world (see synchronous_round)
+        - num_threads: the number of threads among which the players are
+          split in the synchronous update
         """
+        if update not in ("sequential", "synchronous"):
+            print("Error! Unknown update mode", update)
+            quit()
+
+        # players of a population are handled through their views
+        self.population = None
+        if isinstance(players, Population):
+            self.population = players
+            players = players.players()
+
         self.game = game
         self.board = board
         self.num_players = len(players)
@@ -33,36 +57,115 @@ class World():
         self.imitation = imitation
         self.migration = migration
         self.M = M
+        self.debug_payoff_cache = debug_payoff_cache
+        self.rng = make_rng(seed)
+        self.update = update
+        self.num_threads = num_threads
+
+        # payoff of the player in each cell, valid until the strategy or the
+        # position of the player or of one of its neighbors changes
+        self.payoff_cache = {}
 
         # randomly insert players in board cells
-        random_cell_sequence = board.random_cell_sequence()
-        if len(players) > len(random_cell_sequence):
+        if len(players) > board.num_free_cells():
             print("Error! Number of players exceeds the number of cells")
             quit()
 
-        random.shuffle(self.players)
-        for i in range(len(self.players)):
-            self.players[i].cell = random_cell_sequence[i]
-            self.board.assign_player_to_cell(
-                self.players[i], random_cell_sequence[i])
+        # index of the player (in the order in which the players were given,
+        # as the rounds shuffle self.players) in each cell of the board, -1
+        # if empty, kept up to date as the players move
+        self.player_index = {id(player): i for i, player in enumerate(players)}
+        self.player_ids = np.full(board.get_strategy_grid().shape, -1,
+                                  dtype=np.int32)
+
+        free_cells = self.rng.permutation(self.board.free_cells)
+        for i, (player, index) in enumerate(zip(self.players,
+                                                free_cells.tolist())):
+            random_cell = self.board.index_cell(index)
+            player.cell = random_cell
+            self.board.assign_player_to_cell(player, random_cell)
+            self.player_ids[random_cell] = i
+
+        self.count_players()
+
+    def count_players(self):
+        """ sets up the counts of the players from their positions """
+        # number of players using each strategy (by value), kept up to date
+        # by set_strategy so that the statistics can read it in constant time
+        self.strategy_counts = [0] * len(Strategy)
+        for player in self.players:
+            self.strategy_counts[player.strategy.value] += 1
+
+        # number of players with each strategy in the play neighborhood of
+        # each cell, which lets migration score empty cells without moving
+        # the player there
+        self.neighbor_counts = None
+        if self.migration:
+            self.neighbor_counts = {}
+            for player in self.players:
+                self.count_in_neighborhood(player, player.cell, 1)
+
+    def get_state(self):
+        """returns the state of the world which changes during the simulation
+        and is not held by the players or the board: the random number
+        generator and the cached payoffs (see set_state)
+        """
+        return {
+            "rng": self.rng.bit_generator.state,
+            "payoff_cache": dict(self.payoff_cache),
+        }
+
+    def set_state(self, cells, payoffs, state):
+        """puts the players (in the order of self.players) back in the given
+        cells with the given payoffs, and restores a state returned by
+        get_state, to continue a simulation exactly where it was stopped
+        """
+        for player in self.players:
+            self.board.assign_player_to_cell(None, player.cell)
+        self.player_ids[...] = -1
+        for player, cell, payoff in zip(self.players, cells, payoffs):
+            player.cell = cell
+            player.payoff = payoff
+            self.board.assign_player_to_cell(player, cell)
+            self.player_ids[cell] = self.player_index[id(player)]
+
+        self.count_players()
+        self.rng.bit_generator.state = state["rng"]
+        self.payoff_cache = dict(state["payoff_cache"])
 
     def round(self):
         """carries out one round of updates, in which each player is updated
         once based on the parameters of the world
         """
-        random.shuffle(self.players)
-        for player in self.players:
+        if self.update == "sequential":
+            self.sequential_round()
+        else:
+            self.synchronous_round()
+
+        if self.debug_payoff_cache:
+            self.check_payoff_cache()
+
+    def sequential_round(self):
+        """carries out one round in which the players are updated one after
+        the other in random order, each seeing the changes made by the
+        previous ones
+        """
+        self.rng.shuffle(self.players)
+        # the random numbers of the round are drawn at once
+        rands = self.rng.random(self.num_players).tolist()
+        noise1_rands = self.rng.random(self.num_players).tolist()
+        for player, rand, noise1_rand in zip(self.players, rands,
+                                             noise1_rands):
             self.play_with_neighbors(player)
 
             # perform migration step
             if self.migration:
                 self.migration_update(player)
 
-            rand = random.random()
             if rand < self.r:
                 # randomly reset player strategy and/or location
                 if self.noise1:
-                    self.noise1_update(player)
+                    self.noise1_update(player, noise1_rand)
 
                 if self.noise2:
                     self.noise2_update(player)
@@ -72,50 +175,273 @@ class World():
                 if self.imitation:
                     self.imitation_update(player)
 
+    def synchronous_round(self):
+        """carries out one round in which all players are updated at once,
+        like in the synchronous update of VectorizedWorld (with the
+        differences below):
+        1. every player picks the most favorable cell in its migration
+           neighborhood given the world at the start of the round; when
+           several players pick the same empty cell the one with the lowest
+           random priority moves there and the others stay
+        2. every player then either resets (probability r) or imitates the
+           most successful player in its new neighborhood, with the payoffs
+           of the neighbors computed after all migrations and its own payoff
+           being the one it recorded while migrating
+        3. players resetting their location (Noise 2) move one after the
+           other to random empty cells
+        The choices of the players in steps 1 and 2 only read the world, so
+        they are split among num_threads threads. Unlike VectorizedWorld,
+        distances between cells (which decide between equally good cells to
+        migrate to) do not wrap around the periodic boundaries, players
+        resetting their location can take the cells left by those which
+        moved before them, and the random numbers are drawn per player, so
+        the two give the same statistics but not the same runs
+        """
+        self.rng.shuffle(self.players)
+        players = self.players
+        # the random numbers of the round are drawn at once
+        rands = self.rng.random(self.num_players).tolist()
+        noise1_rands = self.rng.random(self.num_players).tolist()
+        tie_rands = self.rng.random(self.num_players).tolist()
+        priorities = self.rng.random(self.num_players).tolist()
+
+        for player in players:
+            self.play_with_neighbors(player)
+        own_payoffs = [player.payoff for player in players]
+
+        if self.migration:
+            targets = self.map_players(self.migration_target, players,
+                                       tie_rands)
+            winners = {}
+            for player, (target, recorded_payoff), priority in zip(
+                    players, targets, priorities):
+                if target != player.cell and (
+                        target not in winners or
+                        priority < winners[target][0]):
+                    winners[target] = (priority, player)
+            for target, (priority, player) in winners.items():
+                self.move_player(player, target)
+            own_payoffs = [recorded_payoff
+                           for target, recorded_payoff in targets]
+
+        noisy = [rand < self.r for rand in rands]
+        new_strategies = [player.strategy for player in players]
+        if self.imitation:
+            for player in players:
+                self.play_with_neighbors(player)
+            new_strategies = self.map_players(
+                self.imitation_choice, players, own_payoffs, noisy)
+        if self.noise1:
+            for i in range(self.num_players):
+                if noisy[i]:
+                    if noise1_rands[i] < self.q:
+                        new_strategies[i] = Strategy.cooperate
+                    else:
+                        new_strategies[i] = Strategy.defect
+        for player, strategy in zip(players, new_strategies):
+            self.set_strategy(player, strategy)
+
+        if self.noise2:
+            for player, player_noisy in zip(players, noisy):
+                if player_noisy:
+                    self.noise2_update(player)
+
+    def map_players(self, function, *sequences):
+        """applies a function to the elements of sequences (one per player),
+        splitting them into one chunk per thread if there are several threads
+        """
+        if self.num_threads <= 1:
+            return list(map(function, *sequences))
+
+        chunk_size = -(-self.num_players // self.num_threads)
+        with ThreadPoolExecutor(self.num_threads) as executor:
+            chunks = executor.map(
+                lambda start: list(map(function, *[
+                    sequence[start:start + chunk_size]
+                    for sequence in sequences])),
+                range(0, self.num_players, chunk_size))
+            return [result for chunk in chunks for result in chunk]
+
     def move_player(self, player, new_cell):
         """moves a player from its current cell on the board to the new cell
         on the board (only if the new cell is unoccupied)
         """
         occupied = self.board.get_player_from_cell(new_cell) != None
         if not occupied:
+            if self.neighbor_counts is not None:
+                self.count_in_neighborhood(player, player.cell, -1)
+                self.count_in_neighborhood(player, new_cell, 1)
+            self.invalidate_payoffs(player.cell)
+            self.invalidate_payoffs(new_cell)
             self.board.assign_player_to_cell(None, player.cell)
             self.board.assign_player_to_cell(player, new_cell)
+            self.player_ids[new_cell] = self.player_ids[player.cell]
+            self.player_ids[player.cell] = -1
             player.cell = new_cell
 
+    def set_strategy(self, player, strategy):
+        """changes the strategy of a player, keeping the strategy and
+        neighbor counts up to date. Strategies must only be changed through
+        this method
+        """
+        if strategy == player.strategy:
+            return
+
+        self.strategy_counts[player.strategy.value] -= 1
+        self.strategy_counts[strategy.value] += 1
+        self.invalidate_payoffs(player.cell)
+        self.board.update_cell_strategy(player.cell, strategy)
+        if self.neighbor_counts is not None:
+            self.count_in_neighborhood(player, player.cell, -1)
+            player.strategy = strategy
+            self.count_in_neighborhood(player, player.cell, 1)
+        else:
+            player.strategy = strategy
+
+    def count_in_neighborhood(self, player, cell, sign):
+        """adds (sign 1) or removes (sign -1) a player standing in a cell to
+        the neighbor counts of the cells in its play neighborhood
+        """
+        for neighboring_cell in self.board.get_cells_in_play_neighborhood(cell):
+            counts = self.neighbor_counts.get(neighboring_cell)
+            if counts is None:
+                counts = [0] * len(Strategy)
+                self.neighbor_counts[neighboring_cell] = counts
+            counts[player.strategy.value] += sign
+
+    def invalidate_payoffs(self, cell):
+        """removes the cached payoffs of the players affected by a change in
+        a cell, i.e. the player in the cell and the players it plays with
+        """
+        self.payoff_cache.pop(cell, None)
+        for neighboring_cell in self.board.get_cells_in_play_neighborhood(cell):
+            self.payoff_cache.pop(neighboring_cell, None)
+
+    def strategy_payoffs(self, player):
+        """returns the payoff of a player against each strategy (by value),
+        read from the payoff matrix of the player when the game has one
+        """
+        payoff_matrix = self.game.player_payoff_matrix(player)
+        if payoff_matrix is not None:
+            return payoff_matrix[player.strategy.value]
+        return [self.game.payoff_against(player, strategy)
+                for strategy in Strategy]
+
+    def payoff_in_cell(self, cell, strategy_payoffs, own_counts=None):
+        """returns the payoff a player would receive by playing with the
+        players in the play neighborhood of a cell, using the neighbor counts
+        and the payoffs of the player against each strategy (by value). The
+        counts of the player itself in each cell can be given as own_counts,
+        to be left out without changing the neighbor counts. Summing per
+        strategy gives exactly the same payoff for every arrangement of the
+        same neighbors, but may differ in the last bits from adding up the
+        games one neighbor after another
+        """
+        payoff = 0
+        counts = self.neighbor_counts.get(cell)
+        if own_counts is not None and cell in own_counts:
+            counts = [count - own_count
+                      for count, own_count in zip(counts, own_counts[cell])]
+        if counts:
+            for count, strategy_payoff in zip(counts, strategy_payoffs):
+                if count:
+                    payoff += count * strategy_payoff
+
+        return payoff
+
     def play_with_neighbors(self, player):
         """makes a player play a game with its four neighbors and record its
-        total payoff
+        total payoff, which is only computed again once the player or one of
+        its neighbors has changed
+        """
+        payoff = self.payoff_cache.get(player.cell)
+        if payoff is None:
+            if self.neighbor_counts is not None:
+                payoff = self.payoff_in_cell(player.cell,
+                                             self.strategy_payoffs(player))
+            else:
+                payoff_matrix = self.game.player_payoff_matrix(player)
+                if payoff_matrix is not None:
+                    counts = \
+                        self.board.get_strategy_counts_in_play_neighborhood(
+                            player.cell)
+                    payoff = self.game.payoff_against_counts(
+                        player.strategy.value, counts, payoff_matrix)
+                else:
+                    payoff = self.fresh_payoff(player)
+            self.payoff_cache[player.cell] = payoff
+        elif self.debug_payoff_cache:
+            self.check_cached_payoff(player, payoff)
+
+        player.payoff = payoff
+
+    def fresh_payoff(self, player):
+        """computes the payoff of a player by playing with all of its
+        neighbors, ignoring the cache
         """
         neighbors = self.board.get_players_in_play_neighborhood(player.cell)
 
-        player.payoff = 0
+        payoff = 0
         for neighbor in neighbors:
-            player.payoff += self.game.play(player, neighbor)[0]
+            payoff += self.game.play(player, neighbor)[0]
+
+        return payoff
 
-    def noise1_update(self, player):
+    def check_cached_payoff(self, player, payoff):
+        """stops the simulation if a cached payoff differs from the payoff
+        computed from scratch
+        """
+        fresh_payoff = self.fresh_payoff(player)
+        if not math.isclose(payoff, fresh_payoff, rel_tol=1e-9,
+                            abs_tol=1e-12):
+            print("Error! Cached payoff", payoff, "of the player in cell",
+                  player.cell, "differs from its actual payoff", fresh_payoff)
+            quit()
+
+    def check_payoff_cache(self):
+        """checks all cached payoffs against a fresh computation, and the
+        strategy counts against a count of the players
+        """
+        for cell in list(self.payoff_cache):
+            player = self.board.get_player_from_cell(cell)
+            if player is None:
+                print("Error! Cached payoff for the empty cell", cell)
+                quit()
+            self.check_cached_payoff(player, self.payoff_cache[cell])
+
+        for strategy in Strategy:
+            count = sum(1 for player in self.players
+                        if player.strategy == strategy)
+            if count != self.strategy_counts[strategy.value]:
+                print("Error! Counted", self.strategy_counts[strategy.value],
+                      "players using", strategy, "instead of", count)
+                quit()
+
+    def noise1_update(self, player, rand=None):
         """resets the strategy of the player according to the Noise 1 process
-        described in the Helbing paper
+        described in the Helbing paper, given a uniform random number (which
+        is drawn if not given)
         """
-        rand = random.random()
+        if rand is None:
+            rand = self.rng.random()
         if rand < self.q:
-            player.strategy = Strategy.cooperate
+            self.set_strategy(player, Strategy.cooperate)
         else:
-            player.strategy = Strategy.defect
+            self.set_strategy(player, Strategy.defect)
 
     def noise2_update(self, player):
         """randomizes the location of the player according to the Noise 2
         process described in the Helbing paper
         """
-        random_cell_sequence = self.board.random_cell_sequence()
-        while random_cell_sequence:
-            random_cell = random_cell_sequence.pop(0)
-            if not self.board.occupied(random_cell):
-                self.move_player(player, random_cell)
-                break
+        random_cell = self.board.random_free_cell(self.rng)
+        if random_cell is not None:
+            self.move_player(player, random_cell)
 
     def migration_update(self, player):
         """performs a migration step for a player according to the migration
-        process described in the Helbing paper
+        process described in the Helbing paper. The payoffs in the empty cells
+        are computed from the neighbor counts, so the player is only moved
+        once it has chosen its cell
         """
         current_cell = player.cell
 
@@ -123,36 +449,113 @@ class World():
         migration_payoff = {}
 
         # calculate payoff in current cell
-        current_cell = player.cell
         self.play_with_neighbors(player)
-        migration_payoff[player.cell] = player.payoff
+        migration_payoff[current_cell] = player.payoff
         best_payoff = player.payoff
 
-        # simulate payoffs in neighboring empty cells
+        # a player does not play with itself, wherever it migrates to
+        self.count_in_neighborhood(player, current_cell, -1)
+        strategy_payoffs = self.strategy_payoffs(player)
+
+        # simulate payoffs in neighboring empty cells (the player keeps the
+        # payoff of the last cell it tried)
         empty_cells = self.board.get_empty_cells_in_migration_neighboorhood(
-            player.cell, self.M
+            current_cell, self.M
         )
         for empty_cell in empty_cells:
-            self.move_player(player, empty_cell)
-            self.play_with_neighbors(player)
+            player.payoff = self.payoff_in_cell(empty_cell, strategy_payoffs)
 
-            migration_payoff[player.cell] = player.payoff
+            migration_payoff[empty_cell] = player.payoff
             if player.payoff > best_payoff:
                 best_payoff = player.payoff
 
         # migrate to most closest favorable cell
+        closest_best_cell = self.closest_best_cell(
+            current_cell, migration_payoff, best_payoff)
+        if closest_best_cell != current_cell:
+            self.invalidate_payoffs(current_cell)
+            self.invalidate_payoffs(closest_best_cell)
+            self.player_ids[closest_best_cell] = self.player_ids[current_cell]
+            self.player_ids[current_cell] = -1
+        self.board.assign_player_to_cell(None, current_cell)
+        self.board.assign_player_to_cell(player, closest_best_cell)
+        player.cell = closest_best_cell
+        self.count_in_neighborhood(player, closest_best_cell, 1)
+
+    def closest_best_cell(self, current_cell, migration_payoff, best_payoff,
+                          rand=None):
+        """returns the closest of the cells with the best payoff to the
+        current cell, chosen uniformly between equally close cells with a
+        uniform random number (which is drawn if needed and not given)
+        """
         best_cells = []
         for cell in migration_payoff:
             if migration_payoff[cell] == best_payoff:
                 best_cells.append(cell)
 
-        random.shuffle(best_cells)
-        closest_best_cell = min(
-            best_cells,
-            key=lambda cell: self.board.get_distance_between(
-                cell, current_cell),
+        distances = [self.board.get_distance_rank(cell, current_cell)
+                     for cell in best_cells]
+        closest_distance = min(distances)
+        closest_best_cells = [cell for cell, distance
+                              in zip(best_cells, distances)
+                              if distance == closest_distance]
+        if len(closest_best_cells) == 1:
+            return closest_best_cells[0]
+        if rand is None:
+            return closest_best_cells[
+                int(self.rng.integers(len(closest_best_cells)))]
+        return closest_best_cells[int(rand * len(closest_best_cells))]
+
+    def migration_target(self, player, rand):
+        """returns the cell a player would migrate to in the synchronous
+        update, chosen like in migration_update but without moving the player
+        or changing the neighbor counts, and the payoff it records in the
+        last empty cell it tries (or its current payoff if there is none)
+        """
+        current_cell = player.cell
+        migration_payoff = {current_cell: player.payoff}
+        best_payoff = player.payoff
+        recorded_payoff = player.payoff
+
+        # a player does not play with itself, wherever it migrates to
+        own_counts = {}
+        for cell in self.board.get_cells_in_play_neighborhood(current_cell):
+            counts = own_counts.setdefault(cell, [0] * len(Strategy))
+            counts[player.strategy.value] += 1
+        strategy_payoffs = self.strategy_payoffs(player)
+
+        empty_cells = self.board.get_empty_cells_in_migration_neighboorhood(
+            current_cell, self.M
         )
-        self.move_player(player, closest_best_cell)
+        for empty_cell in empty_cells:
+            recorded_payoff = self.payoff_in_cell(empty_cell, strategy_payoffs,
+                                                  own_counts)
+            migration_payoff[empty_cell] = recorded_payoff
+            if recorded_payoff > best_payoff:
+                best_payoff = recorded_payoff
+
+        target = self.closest_best_cell(current_cell, migration_payoff,
+                                        best_payoff, rand)
+        return target, recorded_payoff
+
+    def imitation_choice(self, player, own_payoff, noisy):
+        """returns the strategy of the most successful player in the play
+        neighborhood of a player in the synchronous update, given the payoff
+        of the player itself and the payoffs its neighbors have recorded
+        (the player keeps its strategy if it is noisy)
+        """
+        if noisy:
+            return player.strategy
+
+        strategy = player.strategy
+        greatest_payoff = own_payoff
+        for neighbor in self.board.get_players_in_play_neighborhood(
+                player.cell):
+            if neighbor.payoff > greatest_payoff:
+                greatest_payoff = neighbor.payoff
+                strategy = neighbor.strategy
+
+        return strategy
 
     def imitation_update(self, player):
         """performs an imitation step for a player according to the imitation
@@ -170,13 +573,14 @@ class World():
                 greatest_payoff = neighbor.payoff
                 most_successful_neighbor = neighbor
 
-        player.strategy = most_successful_neighbor.strategy
+        self.set_strategy(player, most_successful_neighbor.strategy)
+
+    def get_strategy_grid(self):
+        """returns the strategy values of the players on a rectangular grid
+        as an array, with -1 in empty cells
+        """
+        return self.board.get_strategy_grid()
 
     def get_num_players_with_strategy(self, strat):
         """ returns the number of players on the grid using a stratgy """
-        counter = 0
-        for i in range(len(self.players)):
-            if self.players[i].strategy == strat:
-                counter += 1
-
-        return counter
+        return self.strategy_counts[strat.value]
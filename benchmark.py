@@ -0,0 +1,242 @@
+import os
+import sys
+import json
+import time
+import platform
+import contextlib
+import tracemalloc
+import numpy as np
+from World import World
+from VectorizedWorld import VectorizedWorld
+from ParallelWorld import ParallelWorld
+from Board import RectangularGrid, Network
+from Game import (
+    PrisonersDilemma,
+    AsymmetricPrisonersDilemma,
+    PrisonersDilemmaPlayer,
+    Strategy,
+    asymmetric_prisoners_dilemma_players,
+    make_rng,
+)
+
+"""
+Benchmarks of World.round (and of the other engines) with fixed seeds, to
+compare engines and catch performance regressions.
+
+Every case builds a world from a fixed seed, runs a few warm up rounds and
+then times a fixed number of rounds, reporting the rounds per second, the
+player updates per second and the peak memory (allocated by Python and
+NumPy while building the world and running two rounds, measured in a
+separate run as tracing allocations slows the rounds down). The results are
+saved as JSON and compared to a baseline saved earlier.
+"""
+
+ENGINES = {
+    "World": lambda args: World(**args),
+    "World/synchronous": lambda args: World(update="synchronous", **args),
+    "VectorizedWorld": lambda args: VectorizedWorld(**args),
+    "VectorizedWorld/synchronous":
+        lambda args: VectorizedWorld(update="synchronous", **args),
+    "ParallelWorld/2 workers":
+        lambda args: ParallelWorld(num_workers=2, **args),
+}
+
+# the update rules of the cases
+RULES = {
+    "imitation": dict(r=0.05, q=0.05, noise1=True, imitation=True),
+    "migration": dict(migration=True),
+    "imitation+migration": dict(r=0.05, q=0.05, noise1=True, imitation=True,
+                                migration=True),
+    "all": dict(r=0.05, q=0.05, noise1=True, noise2=True, imitation=True,
+                migration=True),
+}
+
+# number of timed rounds on grids by size
+GRID_SIZES = {"small": (20, 20, 50), "medium": (60, 60, 10),
+              "large": (150, 150, 3)}
+
+
+def benchmark_cases():
+    """returns the benchmark cases: the arguments of make_world and the
+    number of timed rounds, by name
+    """
+    cases = {}
+
+    def add(engine="World", board="grid", size="medium", density=0.5, M=2,
+            rules="imitation+migration", game="symmetric", N=1000, k=4,
+            rounds=None):
+        if board == "grid":
+            height, width, grid_rounds = GRID_SIZES[size]
+            name = "%s grid %dx%d density %g M %d %s %s" % (
+                engine, height, width, density, M, rules, game)
+            board_args = dict(height=height, width=width)
+        else:
+            grid_rounds = 5
+            name = "%s network N %d k %d density %g M %d %s %s" % (
+                engine, N, k, density, M, rules, game)
+            board_args = dict(N=N, k=k)
+        cases[name] = dict(
+            world=dict(engine=engine, board=board, board_args=board_args,
+                       density=density, M=M, rules=rules, game=game),
+            rounds=rounds or grid_rounds)
+
+    # engines across grid sizes
+    for size in GRID_SIZES:
+        for engine in ENGINES:
+            add(engine, size=size)
+
+    # densities, migration ranges, update rules and games on a medium grid
+    for density in (0.2, 0.8):
+        add(density=density)
+        add("VectorizedWorld", density=density)
+    for M in (1, 5):
+        add(M=M)
+        add("VectorizedWorld", M=M)
+    for rules in RULES:
+        if rules != "imitation+migration":
+            add(rules=rules)
+            add("VectorizedWorld", rules=rules)
+    for engine in ENGINES:
+        add(engine, game="asymmetric")
+
+    # networks
+    for N in (1000, 10000):
+        for k in (4, 10):
+            add(board="network", N=N, k=k)
+
+    return cases
+
+
+def make_world(engine, board, board_args, density, M, rules, game, seed=0):
+    """ builds the world of a benchmark case from a fixed seed """
+    rng = make_rng(seed)
+    if board == "grid":
+        board = RectangularGrid(seed=rng, **board_args)
+        num_cells = board_args["height"] * board_args["width"]
+    else:
+        board = Network(p=0.05, csr=True, seed=rng, **board_args)
+        num_cells = board_args["N"]
+
+    strategies = [Strategy.cooperate if rand < 0.5 else Strategy.defect
+                  for rand in rng.random(int(num_cells * density))]
+    if game == "symmetric":
+        game = PrisonersDilemma(1.3, 1, 0.1, 0)
+        players = [PrisonersDilemmaPlayer(strategy) for strategy in strategies]
+    else:
+        game = AsymmetricPrisonersDilemma(1.3, 1, 0.1, 0)
+        players = asymmetric_prisoners_dilemma_players(strategies, 0.3, rng)
+
+    args = dict(game=game, board=board, players=players, M=M, seed=rng)
+    args.update(RULES[rules])
+    return ENGINES[engine](args)
+
+
+def opened(world):
+    """returns a context manager for a world, which stops the workers of a
+    ParallelWorld when leaving it
+    """
+    if isinstance(world, ParallelWorld):
+        return world
+    return contextlib.nullcontext(world)
+
+
+def run_case(case, warmup_rounds=1, seed=0):
+    """ times a benchmark case and returns its results """
+    with opened(make_world(seed=seed, **case["world"])) as world:
+        for i in range(warmup_rounds):
+            world.round()
+        start = time.perf_counter()
+        for i in range(case["rounds"]):
+            world.round()
+        elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    with opened(make_world(seed=seed, **case["world"])) as world:
+        for i in range(2):
+            world.round()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return {
+        "rounds": case["rounds"],
+        "seconds": elapsed,
+        "rounds_per_second": case["rounds"] / elapsed,
+        "updates_per_second": case["rounds"] * world.num_players / elapsed,
+        "peak_memory_mb": peak_memory / 2 ** 20,
+    }
+
+
+def run_benchmarks(cases, seed=0):
+    """ runs benchmark cases, printing their results as they finish """
+    results = {}
+    for name, case in cases.items():
+        results[name] = run_case(case, seed=seed)
+        print("%-85s %9.2f rounds/s %12.0f updates/s %8.1f MB" % (
+            name, results[name]["rounds_per_second"],
+            results[name]["updates_per_second"],
+            results[name]["peak_memory_mb"]))
+
+    return results
+
+
+def save_results(results, filename, seed=0):
+    """ writes benchmark results to a JSON file with the machine details """
+    with open(filename, "w") as f:
+        json.dump({
+            "date": time.strftime("%Y-%m-%d %H:%M:%S"),
+            "python": sys.version.split()[0],
+            "numpy": np.__version__,
+            "machine": platform.platform(),
+            "processor": platform.processor(),
+            "seed": seed,
+            "results": results,
+        }, f, indent=2)
+
+
+def compare_to_baseline(results, filename, tolerance=0.2):
+    """compares benchmark results to a baseline saved with save_results and
+    returns the names of the cases which are more than tolerance slower
+    """
+    with open(filename) as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        ratio = (result["rounds_per_second"] /
+                 baseline[name]["rounds_per_second"])
+        print("%-85s %6.2fx" % (name, ratio))
+        if ratio < 1 - tolerance:
+            regressions.append(name)
+
+    return regressions
+
+
+if __name__ == "__main__":
+    """ Adjust benchmark parameters here """
+
+    # the seed of all worlds; results are only comparable with the same seed
+    seed = 0
+
+    # only run the cases whose name contains this text ("" for all)
+    selection = ""
+
+    # the results of this run, and the baseline to compare them to. Copy
+    # the results to the baseline to make them the new reference
+    results_file = "benchmark_results.json"
+    baseline_file = "benchmark_baseline.json"
+    tolerance = 0.2  # slowdown relative to the baseline flagged as regression
+
+    cases = {name: case for name, case in benchmark_cases().items()
+             if selection in name}
+    results = run_benchmarks(cases, seed)
+    save_results(results, results_file, seed)
+
+    if os.path.exists(baseline_file):
+        print()
+        print("Speed relative to", baseline_file)
+        regressions = compare_to_baseline(results, baseline_file, tolerance)
+        if regressions:
+            print()
+            quit("Regressions in: " + ", ".join(regressions))
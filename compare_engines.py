@@ -0,0 +1,169 @@
+import contextlib
+import random
+import numpy as np
+from World import World
+from VectorizedWorld import VectorizedWorld
+from ParallelWorld import ParallelWorld
+from Board import RectangularGrid
+from Game import (
+    PrisonersDilemma,
+    AsymmetricPrisonersDilemma,
+    PrisonersDilemmaPlayer,
+    Strategy,
+    asymmetric_prisoners_dilemma_players,
+)
+
+
+def cooperator_fractions(world_class, num_replicates, rounds, seed=0,
+                         **world_args):
+    """runs independent replicates of a world type on a fresh grid and
+    returns the fraction of cooperators at the end of each replicate
+    """
+    fractions = []
+    for replicate in range(num_replicates):
+        random.seed(seed + replicate)
+        np.random.seed(seed + replicate)
+        world = world_class(**make_world_args(**world_args))
+        for iteration in range(rounds):
+            world.round()
+        fractions.append(
+            world.get_num_players_with_strategy(Strategy.cooperate)
+            / world.num_players)
+
+    return np.array(fractions)
+
+
+def make_world_args(grid_height=20, grid_width=20, density=0.5,
+                    p_cooperation=0.5, T=1.3, R=1, P=0.1, S=0,
+                    p_unsatisfied=None, **world_args):
+    """creates the game, board and players of a world on a rectangular grid
+    and returns them together with the remaining world arguments. The game
+    is an asymmetric prisoners dilemma if p_unsatisfied, the probability
+    that a need of a player is not satisfied, is given
+    """
+    strategies = []
+    for i in range(int(grid_height * grid_width * density)):
+        rand = random.random()
+        if rand < p_cooperation:
+            strategies.append(Strategy.cooperate)
+        else:
+            strategies.append(Strategy.defect)
+
+    if p_unsatisfied is None:
+        game = PrisonersDilemma(T, R, P, S)
+        players = [PrisonersDilemmaPlayer(strategy) for strategy in strategies]
+    else:
+        game = AsymmetricPrisonersDilemma(T, R, P, S)
+        players = asymmetric_prisoners_dilemma_players(strategies,
+                                                       p_unsatisfied)
+
+    world_args.update(game=game,
+                      board=RectangularGrid(grid_height, grid_width),
+                      players=players)
+    return world_args
+
+
+def welch_t(a, b):
+    """returns Welch's t statistic for the difference between the means of
+    two samples
+    """
+    standard_error = np.sqrt(a.var(ddof=1) / len(a) + b.var(ddof=1) / len(b))
+    if standard_error == 0:
+        return 0.0 if a.mean() == b.mean() else np.inf
+    return (a.mean() - b.mean()) / standard_error
+
+
+def compare_to_world(num_replicates=100, rounds=15, max_t=3.5,
+                     **world_args):
+    """checks that VectorizedWorld produces the same distribution of
+    cooperator fractions as World, in the update mode given in world_args
+    (sequential by default). Returns whether Welch's t statistic between the
+    two engines is below max_t
+    """
+    reference = cooperator_fractions(World, num_replicates, rounds,
+                                     **world_args)
+    vectorized = cooperator_fractions(VectorizedWorld, num_replicates, rounds,
+                                      seed=num_replicates, **world_args)
+    t = welch_t(reference, vectorized)
+    print("World:           mean %.4f std %.4f"
+          % (reference.mean(), reference.std()))
+    print("VectorizedWorld: mean %.4f std %.4f"
+          % (vectorized.mean(), vectorized.std()))
+    print("Welch t = %.2f" % t)
+
+    return abs(t) < max_t
+
+
+def grid_after_rounds(world_class, rounds, seed=0, **world_args):
+    """runs a world on a fresh grid and returns its strategy and player
+    arrays after a number of rounds
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    world = world_class(seed=seed, **make_world_args(**world_args))
+    # ParallelWorld stops its workers at the end of the with block
+    with world if world_class is ParallelWorld else contextlib.nullcontext():
+        for iteration in range(rounds):
+            world.round()
+        return (world.strategies.copy(), world.player_ids.copy())
+
+
+def compare_parallel_world(worker_counts=(1, 2, 4), rounds=10,
+                           **world_args):
+    """checks that ParallelWorld gives exactly the same grid as the
+    synchronous update mode of VectorizedWorld, for several numbers of
+    workers
+    """
+    reference = grid_after_rounds(VectorizedWorld, rounds,
+                                  update="synchronous", **world_args)
+    identical = True
+    for num_workers in worker_counts:
+        grid = grid_after_rounds(ParallelWorld, rounds,
+                                 num_workers=num_workers, **world_args)
+        same = all((a == b).all() for a, b in zip(reference, grid))
+        print("ParallelWorld with %d workers:" % num_workers,
+              "identical" if same else "different")
+        identical = identical and same
+
+    return identical
+
+
+if __name__ == "__main__":
+    """ statistical equivalence of the engines for several update rules """
+    scenarios = [
+        dict(r=0.05, q=0.05, noise1=True, imitation=True),
+        dict(r=0.05, q=0.05, noise1=True, imitation=True, migration=True,
+             M=2),
+        dict(r=0.1, q=0.5, noise1=True, noise2=True, imitation=True,
+             migration=True, M=1),
+        dict(r=0.05, q=0.05, noise1=True, imitation=True, migration=True,
+             M=2, T=2.1, R=1, P=0.3, S=0.1, p_unsatisfied=0.3),
+        dict(r=0.1, q=0.5, noise1=True, noise2=True, imitation=True,
+             migration=True, M=1, update="synchronous"),
+    ]
+
+    passed = True
+    for scenario in scenarios:
+        print(scenario)
+        passed = compare_to_world(**scenario) and passed
+        print()
+
+    if not passed:
+        quit("VectorizedWorld differs significantly from World")
+    print("VectorizedWorld is statistically equivalent to World")
+    print()
+
+    # identical results of the synchronous update for any number of workers
+    parallel_scenarios = [
+        dict(r=0.1, q=0.5, noise1=True, noise2=True, imitation=True,
+             migration=True, M=2),
+        dict(grid_height=30, grid_width=30, r=0.05, q=0.05, noise1=True,
+             imitation=True, migration=True, M=5, T=2.1, R=1, P=0.3, S=0.1,
+             p_unsatisfied=0.3),
+    ]
+    for scenario in parallel_scenarios:
+        print(scenario)
+        if not compare_parallel_world(**scenario):
+            quit("ParallelWorld differs from VectorizedWorld")
+        print()
+    print("ParallelWorld is identical to VectorizedWorld")
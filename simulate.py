@@ -1,38 +1,69 @@
-import random
 import time
 import matplotlib.pyplot as plt
 from World import World
 from Board import RectangularGrid
-from Game import PrisonersDilemma, Player, PrisonersDilemmaPlayer, Strategy
-from SimulationStatistics import StrategyFractionsTimeSeries
+from Game import (
+    PrisonersDilemma,
+    Player,
+    PrisonersDilemmaPlayer,
+    Strategy,
+    make_rng,
+)
+from SimulationStatistics import (
+    StrategyFractionsTimeSeries,
+    AbsorbingState,
+    RollingStationarity,
+)
+from Checkpoint import save_checkpoint, load_checkpoint
 
 
 def simulate(
-    world, stats=None, time_max=30, iteration_max=100000, show_animation=False
+    world, stats=None, time_max=30, iteration_max=100000, show_animation=False,
+    profiler=None, checkpoint_file=None, checkpoint_every=None,
+    checkpoint_seconds=None, start_iteration=0
 ):
     """simulates the evolution of strategies in the world, allowing for
-    visualization and the recording of statistics
+    visualization (of the strategy grid of the world, as the board of a
+    VectorizedWorld is only updated by sync_players) and the recording of
+    statistics. A RoundProfiler given as profiler measures the phases of
+    every round, which are passed to the statistics (see
+    SimulationStatistics.record_metrics).
+
+    With a checkpoint_file, a checkpoint of the world and the statistics is
+    written every checkpoint_every iterations and/or checkpoint_seconds
+    seconds, and when the simulation reaches time_max or iteration_max (see
+    resume). start_iteration is the iteration at which a resumed simulation
+    continues
     """
+    if profiler:
+        profiler.attach(world)
+
     t = time.time()
     time_max = t + time_max
-    iteration = 0
+    iteration = start_iteration
+    last_checkpoint = t
 
     if show_animation:
-        world.board.draw()
+        world.board.draw(world.get_strategy_grid())
 
-    # record statistics
-    if stats:
+    # record statistics, which a resumed simulation already did
+    if stats and start_iteration == 0:
         stats.record_stats(world, iteration)
+    if profiler:
+        # leave the setup out of the metrics of the first round
+        profiler.round_metrics()
 
     while t < time_max and iteration < iteration_max:
         # perform one round of updates
         world.round()
         if show_animation:
-            world.board.draw()
+            world.board.draw(world.get_strategy_grid())
 
         # record statistics
         if stats:
             stats.record_stats(world, iteration)
+            if profiler:
+                stats.record_metrics(profiler.round_metrics(), iteration)
             # stop simulation based on statistics
             if stats.end_simulation(world, iteration):
                 break
@@ -41,13 +72,47 @@ def simulate(
         iteration += 1
         t = time.time()
 
+        if checkpoint_file and (
+                (checkpoint_every and iteration % checkpoint_every == 0) or
+                (checkpoint_seconds and t - last_checkpoint >=
+                 checkpoint_seconds)):
+            save_checkpoint(checkpoint_file, world, stats, iteration)
+            last_checkpoint = t
+    else:
+        # stopped by time_max or iteration_max, so it may be continued
+        if checkpoint_file:
+            save_checkpoint(checkpoint_file, world, stats, iteration)
+
+    # record why the simulation stopped if the statistics did not end it
+    if stats and stats.stop_reason is None:
+        if iteration >= iteration_max:
+            stats.record_stop("iteration_max", iteration)
+        else:
+            stats.record_stop("time_max", iteration)
+
     if show_animation:
         world.board.quit_animation()
 
+    if profiler:
+        profiler.detach()
+
     if stats:
         stats.print_results()
 
 
+def resume(checkpoint_file, stats=None, game=None, **simulate_args):
+    """continues a simulation from a checkpoint written by simulate, with
+    statistics of the same type and settings as the original ones (see
+    load_checkpoint), and goes on writing checkpoints to the same file. The
+    results are the same as if the simulation had not been interrupted.
+    Returns the world
+    """
+    world, iteration = load_checkpoint(checkpoint_file, stats, game)
+    simulate_args.setdefault("checkpoint_file", checkpoint_file)
+    simulate(world, stats, start_iteration=iteration, **simulate_args)
+    return world
+
+
 if __name__ == "__main__":
     """ Adjust simulation parameters here """
 
@@ -59,11 +124,15 @@ if __name__ == "__main__":
     S = 0
     game = PrisonersDilemma(T, R, P, S)
 
+    # the seed of the random number generator (None for a random seed)
+    seed = None
+    rng = make_rng(seed)
+
     # define a world topology ("board") - e.g. grid, network
     # choose a board type from Board.py
     grid_height = 50
     grid_width = 50
-    board = RectangularGrid(grid_height, grid_width)
+    board = RectangularGrid(grid_height, grid_width, seed=rng)
 
     # define the players in the world
     # choose a player type from Game.py
@@ -72,7 +141,7 @@ if __name__ == "__main__":
 
     players = []
     for i in range(num_players):
-        rand = random.random()
+        rand = rng.random()
         if rand < p_cooperation:
             players.append(PrisonersDilemmaPlayer(Strategy.cooperate))
         else:
@@ -94,11 +163,16 @@ if __name__ == "__main__":
 
     # define the statistics to record in the simulation
     # choose a simulations type from SimulationsStatistics.py
-    stats = StrategyFractionsTimeSeries()
+    # the simulation ends early once the fraction of cooperators has
+    # converged according to one of the stopping criteria
+    stopping_criteria = [AbsorbingState(min_duration=20),
+                         RollingStationarity(window=100)]
+    stats = StrategyFractionsTimeSeries(stopping_criteria)
 
     # define the world to simulate evolution of strategies
     world = World(game, board, players, r, q, noise1,
-                  noise2, imitation, migration, M)
+                  noise2, imitation, migration, M, seed=rng)
 
     # perform simulation
     simulate(world, stats, time_max, iteration_max, show_animation)
+    print("Stopped in iteration", stats.stop_iteration, "-", stats.stop_reason)
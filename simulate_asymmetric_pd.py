@@ -1,7 +1,7 @@
-import random
 import time
+import functools
 import matplotlib.pyplot as plt
-from World import World
+from VectorizedWorld import VectorizedWorld
 from Board import RectangularGrid
 from Game import (
     PrisonersDilemma,
@@ -10,18 +10,27 @@ from Game import (
     PrisonersDilemmaPlayer,
     AsymmetricPrisonersDilemmaPlayer,
     Strategy,
+    asymmetric_prisoners_dilemma_players,
+    make_rng,
 )
-from SimulationStatistics import StrategyFractionsTimeSeries
+from SimulationStatistics import (
+    StrategyFractionsTimeSeries4Network,
+    AbsorbingState,
+    RollingStationarity,
+)
+from Sweep import sweep
 
 
 def simulate(
     world, stats=None, time_max=30, iteration_max=100000, show_animation=False
 ):
     """simulates the evolution of strategies in the world, allowing for
-    visualization and the recording of statistics
+    visualization (of the strategy grid of the world, as the board of a
+    VectorizedWorld is only updated by sync_players) and the recording of
+    statistics
     """
     if show_animation:
-        world.board.draw()
+        world.board.draw(world.get_strategy_grid())
 
     t = time.time()
     time_max = t + time_max
@@ -30,7 +39,7 @@ def simulate(
         # perform one round of updates
         world.round()
         if show_animation:
-            world.board.draw()
+            world.board.draw(world.get_strategy_grid())
 
         # record statistics
         if stats:
@@ -43,10 +52,54 @@ def simulate(
         iteration += 1
         t = time.time()
 
+    # record why the simulation stopped if the statistics did not end it
+    if stats and stats.stop_reason is None:
+        if iteration >= iteration_max:
+            stats.record_stop("iteration_max", iteration)
+        else:
+            stats.record_stop("time_max", iteration)
+
     if stats:
         stats.print_results()
 
 
+def simulate_asymmetric_pd(p, game, grid_height, grid_width, num_players,
+                           p_cooperation, r, q, noise1, noise2, imitation,
+                           migration, M, time_max, iteration_max):
+    """simulates a world of asymmetric players on a new grid, where p is the
+    probability that a need of a player is not satisfied, and returns the
+    final fraction of cooperators
+    """
+    # a generator seeded from the global numpy random state, which sweep
+    # seeds for every run
+    rng = make_rng()
+    board = RectangularGrid(grid_height, grid_width, seed=rng)
+
+    strategies = []
+    for i in range(num_players):
+        rand = rng.random()
+        if rand < p_cooperation:
+            strategies.append(Strategy.cooperate)
+        else:
+            strategies.append(Strategy.defect)
+    # the needs of all players are drawn at once
+    players = asymmetric_prisoners_dilemma_players(strategies, p, rng)
+
+    # define the world to simulate evolution of strategies, with the payoff
+    # matrices of all players computed at once
+    world = VectorizedWorld(
+        game, board, players, r, q, noise1, noise2, imitation, migration, M,
+        seed=rng
+    )
+    # end the run early once the fraction of cooperators has converged
+    stats = StrategyFractionsTimeSeries4Network(
+        [AbsorbingState(min_duration=20), RollingStationarity()])
+    simulate(world, stats, time_max, iteration_max)
+    return {"cooperator_fraction": stats.cooperator_fraction_ts[-1],
+            "stop_reason": stats.stop_reason,
+            "stop_iteration": stats.stop_iteration}
+
+
 if __name__ == "__main__":
     """ Adjust simulation parameters here """
 
@@ -62,60 +115,42 @@ if __name__ == "__main__":
     # choose a board type from Board.py
     grid_height = 49
     grid_width = 49
-    board = RectangularGrid(grid_height, grid_width)
 
     # define the players in the world
     # choose a player type from Game.py
     num_players = grid_height * grid_width // 2
     p_cooperation = 0.5
-    coops = []
-    for n in range(1, 10):
-        coops = []
-        for i in range(0, 11):
-            p = i // 10  # prob that need is not satisfied
-
-            players = []
-            for i in range(num_players):
-                rand = random.random()
-                if rand < p_cooperation:
-                    players.append(
-                        AsymmetricPrisonersDilemmaPlayer(Strategy.cooperate, p)
-                    )
-                else:
-                    players.append(
-                        AsymmetricPrisonersDilemmaPlayer(Strategy.defect, p))
-
-            # define player update parameters
-            r = 0.05  # probability that a player randomly resets its strategy
-            q = 0.05  # conditional probability that a player resets to cooperate
-            noise1 = True  # a boolean indicating whether Noise 1 is present
-            noise2 = False  # a boolean indicating whether Noise 2 is present
-            imitation = True  # a boolean indicating whether players perform imitation
-            migration = True  # a boolean indicating whether players perform migration
-            M = 5  # the range of the Moore neighborhood around each cell
-
-            # simulation parameters
-            time_max = 30
-            iteration_max = 200
-            show_animation = False
-
-            # define the statistics to record in the simulation
-            # choose a simulations type from SimulationsStatistics.py
-            stats = StrategyFractionsTimeSeries()
-
-            # define the world to simulate evolution of strategies
-            world = World(
-                game, board, players, r, q, noise1, noise2, imitation, migration, M
-            )
-
-            # perform simulation
-
-            simulate(world, stats, time_max, iteration_max, show_animation)
-            coops.append(stats.record_stats(world, iteration_max))
-            # print(coops)
-            # f=open("/Users/malvika/Downloads/Yanninimalhu-master 4/coops.txt","w")
-            # f.close()
-
+    num_repetitions = 9
+    # prob that need is not satisfied
+    p_values = [i // 10 for i in range(0, 11)]
+
+    # define player update parameters
+    r = 0.05  # probability that a player randomly resets its strategy
+    q = 0.05  # conditional probability that a player resets to cooperate
+    noise1 = True  # a boolean indicating whether Noise 1 is present
+    noise2 = False  # a boolean indicating whether Noise 2 is present
+    imitation = True  # a boolean indicating whether players perform imitation
+    migration = True  # a boolean indicating whether players perform migration
+    M = 5  # the range of the Moore neighborhood around each cell
+
+    # simulation parameters
+    time_max = 30
+    iteration_max = 200
+
+    # all repetitions run in parallel on all cores, each with its own seed
+    # derived from the sweep seed
+    seed = 0
+    run = functools.partial(
+        simulate_asymmetric_pd, game=game, grid_height=grid_height,
+        grid_width=grid_width, num_players=num_players,
+        p_cooperation=p_cooperation, r=r, q=q, noise1=noise1, noise2=noise2,
+        imitation=imitation, migration=migration, M=M, time_max=time_max,
+        iteration_max=iteration_max)
+    results = sweep(run, {"p": p_values}, num_repetitions, seed)
+
+    for n in range(1, num_repetitions + 1):
+        coops = [row["cooperator_fraction"] for row in results
+                 if row["replicate"] == n - 1]
         with open('/Users/malvika/Downloads/Yanninimalhu-master 4/{0}{1}.txt'.format("coops_", n), 'w') as f:
             for item in coops:
                 f.write("%s\n" % item)
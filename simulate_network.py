@@ -1,5 +1,5 @@
-import random
 import time
+import functools
 import matplotlib.pyplot as plt
 from World import World
 from Board import RectangularGrid, Network
@@ -10,8 +10,14 @@ from Game import (
     PrisonersDilemmaPlayer,
     AsymmetricPrisonersDilemmaPlayer,
     Strategy,
+    make_rng,
 )
-from SimulationStatistics import StrategyFractionsTimeSeries4Network
+from SimulationStatistics import (
+    StrategyFractionsTimeSeries4Network,
+    AbsorbingState,
+    RollingStationarity,
+)
+from Sweep import sweep
 import numpy as np
 
 
@@ -48,6 +54,13 @@ def simulate(
         iteration += 1
         t = time.time()
 
+    # record why the simulation stopped if the statistics did not end it
+    if stats and stats.stop_reason is None:
+        if iteration >= iteration_max:
+            stats.record_stop("iteration_max", iteration)
+        else:
+            stats.record_stop("time_max", iteration)
+
     if stats:
         cooperator_fraction_ts = stats.print_results()
 
@@ -55,6 +68,41 @@ def simulate(
     return cooperator_fraction_ts
 
 
+def simulate_network(k, num_nodes, p_rewire, game, p_cooperation, r, q,
+                     noise1, noise2, imitation, migration, M, time_max,
+                     iteration_max):
+    """simulates a world on a new Watts-Strogatz network with mean degree k
+    and returns the final fraction of cooperators
+    """
+    # a generator seeded from the global numpy random state, which sweep
+    # seeds for every run
+    rng = make_rng()
+
+    # csr=True stores the graph in compact arrays for large networks
+    board = Network(num_nodes, k, p_rewire, csr=True, seed=rng)
+
+    # define the players in the world
+    players = []
+    for i in range(num_nodes):  # No empty cells
+        rand = rng.random()
+        if rand < p_cooperation:
+            players.append(PrisonersDilemmaPlayer(Strategy.cooperate))
+        else:
+            players.append(PrisonersDilemmaPlayer(Strategy.defect))
+
+    world = World(
+        game, board, players, r, q, noise1, noise2, imitation, migration, M,
+        seed=rng
+    )
+    # end the run early once the fraction of cooperators has converged
+    stats = StrategyFractionsTimeSeries4Network(
+        [AbsorbingState(min_duration=20), RollingStationarity()])
+    cooperator_fraction_ts = simulate(world, stats, time_max, iteration_max)
+    return {"cooperator_fraction": cooperator_fraction_ts[-1],
+            "stop_reason": stats.stop_reason,
+            "stop_iteration": stats.stop_iteration}
+
+
 if __name__ == "__main__":
     """ Adjust simulation parameters here """
 
@@ -66,73 +114,47 @@ if __name__ == "__main__":
     S = 0
     game = PrisonersDilemma(T, R, P, S)
 
-    # define a world topology ("board") - e.g. grid, network
-    # choose a board type from Board.py
-    # grid_height = 50
-    # grid_width = 50
-    # board = RectangularGrid(grid_height, grid_width)
+    # define the networks ("boards") of the sweep
     num_nodes = 100  # Number of nodes
     number_cases = 10  # Number of simulations
     number_single = 10  # Number of samples for each simulation
+    p_rewire = 0.05  # Probability of rewiring
 
     k = np.linspace(2, 15, number_cases)  # Different values of mean degree
     # p=np.linspace(0.00001,0.01,number_cases) #Different values of probability of rewiring
-    average_fraction_single = 0  # Average of fraction of cooperators per simulation
-    average_fraction_array = np.zeros(
-        number_cases
-    )  # Array with the averages of fraction of cooperators per simulation
+
+    # define the players in the world
+    p_cooperation = 0.5
+
+    # define player update parameters
+    r = 0.05  # probability that a player randomly resets its strategy
+    q = 0.05  # conditional probability that a player resets to cooperate
+    noise1 = True  # a boolean indicating whether Noise 1 is present
+    noise2 = False  # a boolean indicating whether Noise 2 is present
+    imitation = True  # a boolean indicating whether players perform imitation
+    migration = False  # a boolean indicating whether players perform migration
+    M = 5  # the number of hops a player can migrate on the network
+
+    # simulation parameters
+    time_max = 10
+    iteration_max = 5000
+
+    # the samples of all simulations run in parallel on all cores, each with
+    # its own seed derived from the sweep seed
+    seed = 0
+    run = functools.partial(
+        simulate_network, num_nodes=num_nodes, p_rewire=p_rewire, game=game,
+        p_cooperation=p_cooperation, r=r, q=q, noise1=noise1, noise2=noise2,
+        imitation=imitation, migration=migration, M=M, time_max=time_max,
+        iteration_max=iteration_max)
+    results = sweep(run, {"k": [int(ka) for ka in k]}, number_single, seed)
+
+    # Array with the averages of fraction of cooperators per simulation
+    average_fraction_array = np.zeros(number_cases)
     for z in range(0, number_cases):
-        ka = int(k[z])
-        # pa=p[z]
-        for j in range(0, number_single):
-            board = Network(num_nodes, ka, 0.05)
-            # define the players in the world
-            # choose a player type from Game.py
-            num_players = num_nodes  # No empty cells
-            p_cooperation = 0.5
-
-            players = []
-            for i in range(num_players):
-                rand = random.random()
-                if rand < p_cooperation:
-                    players.append(PrisonersDilemmaPlayer(Strategy.cooperate))
-                else:
-                    players.append(PrisonersDilemmaPlayer(Strategy.defect))
-
-            # define player update parameters
-            r = 0.05  # probability that a player randomly resets its strategy
-            q = 0.05  # conditional probability that a player resets to cooperate
-            noise1 = True  # a boolean indicating whether Noise 1 is present
-            noise2 = False  # a boolean indicating whether Noise 2 is present
-            imitation = True  # a boolean indicating whether players perform imitation
-            migration = False  # a boolean indicating whether players perform migration
-            M = 5  # the range of the Moore neighborhood around each cell
-
-            # simulation parameters
-            time_max = 10
-            iteration_max = 5000
-            show_animation = False
-
-            # define the statistics to record in the simulation
-            # choose a simulations type from SimulationsStatistics.py
-            stats = StrategyFractionsTimeSeries4Network()
-
-            # define the world to simulate evolution of strategies
-            world = World(
-                game, board, players, r, q, noise1, noise2, imitation, migration, M
-            )
-
-            # perform simulation
-            cooperator_fraction_ts = simulate(
-                world, stats, time_max, iteration_max, show_animation
-            )
-            average_fraction_single += cooperator_fraction_ts[-1]
-            print(
-                "Sum of fractions for each simulation and each loop:",
-                average_fraction_single,
-            )
-        average_fraction_array[z] = average_fraction_single / number_single
-        average_fraction_single = 0
+        average_fraction_array[z] = np.mean(
+            [row["cooperator_fraction"]
+             for row in results[z * number_single:(z + 1) * number_single]])
         print(
             "Average fraction of cooperators for each simulation=",
             average_fraction_array[z],